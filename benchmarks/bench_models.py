@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+""" Compares the memory used by posts kept as the dicts returned by the API with typed Post objects. Run with
+
+    python benchmarks/bench_models.py
+"""
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import json
+import random
+import tracemalloc
+
+from jodel_api import models
+
+N = 50000
+
+
+def make_post(i):
+    # shaped like a post from /v2/posts/location/, decoded from json like the real responses
+    return json.loads(json.dumps({
+        "post_id": "%024x" % random.getrandbits(96), "discovered_by": 0, "message": "message number %d" % i,
+        "created_at": "2017-06-17T12:%02d:%02d.000Z" % (i % 60, i % 60),
+        "updated_at": "2017-06-17T12:%02d:%02d.000Z" % (i % 60, i % 60),
+        "pin_count": 0, "color": random.choice(["9EC41C", "FF9908", "DD5F5F"]), "got_thanks": False,
+        "thanks_count": 0, "child_count": i % 20, "replier": 0, "post_own": "friend", "distance": i % 10,
+        "location": {"name": "Munich", "loc_accuracy": 0, "loc_coordinates": {"lat": 48.1, "lng": 11.5}},
+        "vote_count": i % 50, "share_count": 0, "user_handle": "%x" % random.getrandbits(40), "tags": [],
+        "notifications_enabled": False, "from_home": False}))
+
+
+def measure(build):
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / float(len(objects)), objects
+
+
+def main():
+    raw = [json.dumps(make_post(i)) for i in range(N)]
+    dict_size, _ = measure(lambda: [json.loads(post) for post in raw])
+    post_size, _ = measure(lambda: [models.Post(json.loads(post)) for post in raw])
+    print("dict: {:.0f} bytes/post, Post: {:.0f} bytes/post ({:.1f}x smaller)".format(
+        dict_size, post_size, dict_size / post_size))
+
+
+if __name__ == '__main__':
+    main()
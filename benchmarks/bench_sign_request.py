@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" Microbenchmark for the CPU cost of preparing a signed request (body serialization + HMAC signature).
+
+Compares the current pipeline (JodelAccount._encode_payload + _sign_request) against the previous one, which
+parsed the url twice, serialized the payload for the signature, keyed a new HMAC on every call and let requests
+serialize the payload a second time. Run with
+
+    python benchmarks/bench_sign_request.py
+"""
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+from future.standard_library import install_aliases
+install_aliases()
+
+import base64
+import datetime
+from hashlib import sha1
+import hmac
+import json
+import os
+import timeit
+from urllib.parse import urlparse
+
+import jodel_api
+
+account_data = {'access_token': 'x' * 36, 'device_uid': 'a' * 64, 'refresh_token': 'x' * 36,
+                'distinct_id': 'x' * 24, 'expiration_date': 4102444800, 'is_legacy': False}
+
+
+def legacy_prepare(j, method, endpoint, params, payload):
+    url = j.api_url.format(endpoint)
+    headers = j._get_headers()
+    timestamp = datetime.datetime.utcnow().isoformat()[:-7] + "Z"
+    req = [method,
+           urlparse(url).netloc,
+           "443",
+           urlparse(url).path,
+           j.access_token,
+           timestamp,
+           "%".join(sorted("{}%{}".format(key, value) for key, value in (params if params else {}).items())),
+           json.dumps(payload) if payload else ""]
+    headers['X-Authorization'] = 'HMAC ' + hmac.new(j.secret, "%".join(req).encode("utf-8"), sha1).hexdigest().upper()
+    # requests serializes json= a second time
+    return json.dumps(payload, allow_nan=False).encode("utf-8") if payload else None
+
+
+def current_prepare(j, method, endpoint, params, payload):
+    headers = j._get_headers()
+    body = j._encode_payload(payload)
+    j._sign_request(method, endpoint, headers, params, body)
+    return body
+
+
+def main():
+    j = jodel_api.JodelAccount(48.148434, 11.567867, "Munich", update_location=False, **account_data)
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "test", "testimg.png"), "rb") as f:
+        image = base64.b64encode(f.read() * 200).decode("utf-8")
+
+    cases = [("GET feed", "GET", "/v2/posts/location/", {"lat": 48.1, "lng": 11.5, "skip": 0, "limit": 60,
+                                                         "after": None, "hashtag": None, "channel": None}, None),
+             ("POST message", "POST", "/v3/posts/", None, {"message": "hello " * 40, "color": "FF9908",
+                                                         "location": j.location_dict, "channel": ""}),
+             ("POST image", "POST", "/v3/posts/", None, {"message": "hello", "color": "FF9908",
+                                                       "location": j.location_dict, "image": image})]
+
+    print("{:<14} {:>12} {:>12} {:>8}".format("case", "legacy [us]", "current [us]", "saved"))
+    for name, method, endpoint, params, payload in cases:
+        number = 20 if "image" in name else 20000
+        args = (j, method, endpoint, params, payload)
+        legacy = min(timeit.repeat(lambda: legacy_prepare(*args), number=number, repeat=5)) / number * 1e6
+        current = min(timeit.repeat(lambda: current_prepare(*args), number=number, repeat=5)) / number * 1e6
+        print("{:<14} {:>12.1f} {:>12.1f} {:>7.0%}".format(name, legacy, current, 1 - current / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -28,7 +28,8 @@ setup(name='jodel_api',
       ],
       keywords='jodel',
       package_dir={'': 'src'},
-      install_requires=['requests', 'future', 'mock', 'varint', 'protobuf'],
+      install_requires=['requests', 'future', 'mock', 'varint', 'protobuf', 'futures; python_version < "3"'],
+      extras_require={'async': ['aiohttp'], 'images': ['Pillow']},
       packages=find_packages('src'),
       setup_requires=['pytest-runner', ],
       tests_require=['pytest', 'flaky'],
@@ -1,6 +1,27 @@
 from __future__ import (absolute_import, print_function, unicode_literals)
+import sys
 
 from jodel_api.protos import mcs_pb2
 from jodel_api.protos import checkin_pb2
 from jodel_api.gcmhack import AndroidAccount
+from jodel_api.actions import ActionQueue
+from jodel_api.cache import ResponseCache
+from jodel_api.codec import JsonCodec
+from jodel_api.crawler import crawl_thread, sweep_locations
+from jodel_api.media import MediaFetcher, get_image_urls
+from jodel_api.models import Post, Reply, FeedPage
+from jodel_api.pool import AccountPool
+from jodel_api.onboarding import create_verified_accounts
+from jodel_api.poller import FeedPoller
+from jodel_api.store import PostStore, AccountStore
+from jodel_api.retry import RetryPolicy, RetryBudget
+from jodel_api.ratelimit import TokenBucket, RateLimiter, set_global_rate_limiter
 from jodel_api.jodel_api import *
+
+# mcs uses selectors, which needs Python 3.4
+if sys.version_info >= (3, 4):
+    from jodel_api.mcs import McsClient
+
+# aio uses async generators, which need Python 3.6
+if sys.version_info >= (3, 6):
+    from jodel_api.aio import AsyncJodelAccount
@@ -0,0 +1,75 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import threading
+import time
+
+from jodel_api.ratelimit import TokenBucket
+from jodel_api.retry import RetryPolicy
+
+
+class ActionQueue:
+    """ Queues votes, pins, thanks and notification toggles of an account and runs them concurrently.
+
+    put() queues one action for a post, extend() the same action for many posts. run() executes all queued
+    actions on a pool of max_workers threads, starting at most `rate` actions per second (None for no limit,
+    the account's own rate limiter applies as well). Actions that fail transiently (see default_retry_policy)
+    are retried with backoff, pass a RetryPolicy as retry_policy to change that. After a run, `report` holds
+    the number of actions that succeeded and failed, the duration and the throughput in actions per
+    second. """
+
+    actions = ("upvote", "downvote", "give_thanks", "pin", "unpin", "enable_notifications", "disable_notifications",
+               "notification_read")
+
+    default_retry_policy = RetryPolicy(max_attempts=4, statuses=(429, 500, 502, 503, 504),
+                                       exceptions=(requests.ConnectionError, requests.Timeout), backoff_factor=0.5)
+
+    def __init__(self, account, max_workers=8, rate=None, retry_policy=None):
+        self.account = account
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(rate) if rate else None
+        self.retry_policy = retry_policy or self.default_retry_policy
+        self.report = None
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def put(self, action, post_id, **kwargs):
+        """ Queues account.<action>(post_id, **kwargs). """
+        if action not in self.actions:
+            raise ValueError("{} is not an action that can be queued.".format(action))
+        with self._lock:
+            self._queue.append((action, post_id, kwargs))
+
+    def extend(self, action, post_ids, **kwargs):
+        for post_id in post_ids:
+            self.put(action, post_id, **kwargs)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def run(self):
+        """ Runs all queued actions and empties the queue. Returns a list of (action, post_id, result) in the
+        order the actions were queued, result is the (status_code, response) of the call or the exception it
+        raised. """
+        with self._lock:
+            queue, self._queue = self._queue, []
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._run_action, queue))
+        seconds = time.time() - start
+
+        succeeded = sum(1 for result in results if isinstance(result, tuple) and result[0] // 100 == 2)
+        self.report = {"actions": len(results), "succeeded": succeeded, "failed": len(results) - succeeded,
+                       "seconds": seconds, "actions_per_second": len(results) / seconds if seconds else 0.0}
+        return [(action, post_id, result) for (action, post_id, _), result in zip(queue, results)]
+
+    def _run_action(self, item):
+        action, post_id, kwargs = item
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        try:
+            return getattr(self.account, action)(post_id, retry_policy=self.retry_policy, **kwargs)
+        except Exception as e:
+            return e
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+from jodel_api import gcmhack
+from jodel_api import models
+from jodel_api import ratelimit
+from jodel_api.jodel_api import JodelAccount
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def create_session(limit=100, limit_per_host=0, keepalive_timeout=15, keep_alive=True, timeout=None):
+    """ Creates an aiohttp.ClientSession to share between AsyncJodelAccounts. limit caps the number of open
+    connections in total, limit_per_host per host (0 means no limit). timeout is the total timeout of a call
+    in seconds. Must be called from within a running event loop. """
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, force_close=not keep_alive,
+                                     keepalive_timeout=keepalive_timeout if keep_alive else None)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+class AsyncJodelAccount(JodelAccount):
+    """ asyncio version of JodelAccount. All API methods are coroutines and return the same
+    (status_code, response) tuples as their JodelAccount counterparts.
+
+    The constructor never touches the network, use the create() coroutine to get an account
+    that is set up like one from the JodelAccount constructor. Pass a shared aiohttp.ClientSession
+    as `session` to run many accounts over one connection pool, otherwise each account opens its
+    own session which is closed by close(). See create_session() to configure the connection pool. """
+
+    _token_keys = ('access_token', 'device_uid', 'refresh_token', 'distinct_id', 'expiration_date')
+    _init_keys = _token_keys + ('is_legacy', 'session', 'retry_policy', 'rate_limiter', 'codec', 'cache',
+                               'coalesce_requests', 'account_store')
+
+    def __init__(self, lat, lng, city, country=None, name=None, access_token=None, device_uid=None,
+                 refresh_token=None, distinct_id=None, expiration_date=None, is_legacy=True, session=None,
+                 retry_policy=None, rate_limiter=None, codec=None, cache=None, coalesce_requests=False,
+                 account_store=None, update_location=False, lazy=True):
+        # update_location and lazy are taken like by JodelAccount (eg. from AccountStore.load()), the
+        # constructor never makes remote calls anyway
+        if aiohttp is None:
+            raise ImportError("AsyncJodelAccount requires aiohttp, install it with `pip install jodel_api[async]`.")
+
+        self.lat, self.lng, self.location_dict = lat, lng, self._get_location_dict(lat, lng, city, country, name)
+        self.is_legacy = is_legacy
+        self.device_uid = device_uid
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.distinct_id = distinct_id
+        self.expiration_date = expiration_date
+
+        self.session = session
+        self._owns_session = session is None
+        self.rate_limiter, self.cache = rate_limiter, cache
+        self._init_locks()
+        self.coalesce_requests, self.account_store = coalesce_requests, account_store
+        if codec is not None:
+            self.codec = codec
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+
+    def _init_locks(self):
+        # the asyncio.Lock is created on first use, within the event loop
+        self._token_lock, self._in_flight = None, {}
+
+    @classmethod
+    async def create(cls, lat, lng, city, country=None, name=None, update_location=True, **kwargs):
+        """ Counterpart of the JodelAccount constructor: refreshes all tokens (creating a new account if no
+        device_uid is passed) or, if the full account data is passed, updates the location. Takes the
+        arguments of the constructor, remaining kwargs are passed to the API call. """
+        init_kwargs = {key: kwargs.pop(key) for key in cls._init_keys if key in kwargs}
+        account = cls(lat, lng, city, country, name, **init_kwargs)
+
+        try:
+            if all(init_kwargs.get(key) for key in cls._token_keys):
+                if update_location:
+                    r = await account.set_location(lat, lng, city, country, name, **kwargs)
+                    if r[0] != 204:
+                        raise Exception("Error updating location: " + str(r))
+            else:
+                r = await account.refresh_all_tokens(**kwargs)
+                if r[0] != 200:
+                    raise Exception("Error creating new account: " + str(r))
+        except:
+            await account.close()
+            raise
+
+        return account
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def _send_request(self, method, endpoint, params=None, payload=None, **kwargs):
+        retry_policy = kwargs.pop('retry_policy', None) or self.retry_policy
+        model = kwargs.pop('model', None)
+        # use_cache=False skips reading the cache, the response still updates it
+        use_cache, cache = kwargs.pop('use_cache', True), self.cache
+
+        cached = cache.get(self.device_uid, method, endpoint, params) if use_cache and cache is not None else None
+        if cached is not None:
+            return self._to_model(cached[0], cached[1], model)
+
+        if self.coalesce_requests and method == "GET":
+            key = (endpoint, tuple(sorted((params or {}).items())))
+            future = self._in_flight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(self._send_authorized_request(method, endpoint, params, payload,
+                                                                             retry_policy, **kwargs))
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            # shielded, a cancelled caller doesn't cancel the request for the others
+            status, content_type, content = await asyncio.shield(future)
+        else:
+            status, content_type, content = await self._send_authorized_request(method, endpoint, params, payload,
+                                                                                retry_policy, **kwargs)
+
+        resp = self.codec.decode(content, content_type)
+        if cache is not None:
+            cache.set(self.device_uid, method, endpoint, params, status, resp)
+        return self._to_model(status, resp, model)
+
+    async def _send_authorized_request(self, method, endpoint, params, payload, retry_policy, **kwargs):
+        auto_refresh = self.refresh_token and endpoint not in self._token_endpoints
+        if auto_refresh and self._is_token_expiring():
+            await self._refresh_token_once(self.access_token, **kwargs)
+
+        access_token = self.access_token
+        status, content_type, content = await self._send_signed_request(method, endpoint, params, payload,
+                                                                        retry_policy, **kwargs)
+        if status == 401 and auto_refresh and await self._refresh_token_once(access_token, **kwargs):
+            status, content_type, content = await self._send_signed_request(method, endpoint, params, payload,
+                                                                            retry_policy, **kwargs)
+        return status, content_type, content
+
+    async def _send_signed_request(self, method, endpoint, params, payload, retry_policy, **kwargs):
+        url = self.api_url.format(endpoint)
+        # aiohttp refuses None values in the query string, requests silently drops them
+        query = {key: value for key, value in params.items() if value is not None} if params else None
+        body = self._encode_payload(payload)
+        retry_policy.record_call()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            delay = ratelimit.reserve(self.rate_limiter, method, endpoint)
+            if delay:
+                await asyncio.sleep(delay)
+
+            # read the token once per attempt, another task may have refreshed it while this one slept
+            access_token = self.access_token or ""
+            headers = {key: value for key, value in self._get_headers(access_token).items() if value is not None}
+            self._sign_request(method, endpoint, headers, params, body, access_token)
+            data = body or None
+            if body and not isinstance(body, bytes):
+                # aiohttp streams async iterables only, the length is known up front
+                headers['Content-Length'] = str(len(body))
+                data = _aiter(body)
+            try:
+                async with self._get_session().request(method, url, params=query, data=data,
+                                                       headers=headers, **kwargs) as resp:
+                    status, content = resp.status, await resp.read()
+                    content_type, retry_after = resp.headers.get('Content-Type'), resp.headers.get('Retry-After')
+            except Exception as e:
+                if not retry_policy.is_retry(method, attempt, exception=e):
+                    raise
+                await asyncio.sleep(retry_policy.get_backoff(attempt))
+                continue
+
+            if not retry_policy.is_retry(method, attempt, status=status):
+                return status, content_type, content
+            await asyncio.sleep(retry_policy.get_backoff(attempt, retry_after))
+
+    async def _refresh_token_once(self, access_token, **kwargs):
+        """ See JodelAccount._refresh_token_once(), only one coroutine refreshes the token at a time. """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+
+        async with self._token_lock:
+            if self.access_token != access_token:
+                return True
+            if time.time() < self._next_refresh:
+                return False
+
+            self._next_refresh = time.time() + self.min_refresh_interval
+            return (await self.refresh_access_token(**kwargs))[0] == 200
+
+    async def batch(self, calls, max_workers=8, **kwargs):
+        """ Runs many API calls of this account concurrently, at most max_workers at a time. See
+        JodelAccount.batch() for the format of calls and the results. """
+        calls = [self._get_batch_call(call, kwargs) for call in calls]
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def run(call):
+            func, args, call_kwargs = call
+            async with semaphore:
+                try:
+                    return await func(*args, **call_kwargs)
+                except Exception as e:
+                    return e
+
+        return await asyncio.gather(*[run(call) for call in calls])
+
+    async def _iter_posts(self, post_types="", after=None, mine=False, hashtag=None, channel=None, pictures=False,
+                          limit=60, max_pages=None, prefetch=True, **kwargs):
+        """ Async generator version of JodelAccount._iter_posts(), the next page is prefetched in a task. """
+        def get_page(after, skip):
+            return self._get_posts(post_types, skip, limit, after, mine, hashtag, channel, pictures, **kwargs)
+
+        skip, pages, last_ids = 0, 0, None
+        page = asyncio.ensure_future(get_page(after, skip)) if prefetch else None
+        try:
+            while True:
+                status, resp = await (page if prefetch else get_page(after, skip))
+                if status != 200:
+                    raise Exception("Error reading posts: " + str((status, resp)))
+                posts = models.get_posts(resp)
+                pages += 1
+
+                # if the API ignores skip, a /mine/ page repeats the previous one
+                ids = [models.get_post_id(post) for post in posts]
+                if mine and posts and ids == last_ids:
+                    return
+                last_ids = ids
+
+                next_after = models.get_post_id(posts[-1]) if posts else None
+                has_next = posts and (max_pages is None or pages < max_pages) and (mine or next_after != after)
+                if has_next:
+                    after, skip = (None, skip + len(posts)) if mine else (next_after, skip)
+                    if prefetch:
+                        page = asyncio.ensure_future(get_page(after, skip))
+
+                for post in posts:
+                    yield post
+
+                if not has_next:
+                    return
+        finally:
+            if page is not None and not page.done():
+                page.cancel()
+
+    async def refresh_all_tokens(self, **kwargs):
+        """ Creates a new account with random ID if self.device_uid is not set. Otherwise renews all tokens of the
+        account with ID = self.device_uid. """
+        resp = await self._send_request("POST", "/v2/users", payload=self._get_all_tokens_payload(), **kwargs)
+        if resp[0] == 200:
+            self._update_tokens(resp[1])
+        else:
+            raise Exception(resp)
+        return resp
+
+    async def refresh_access_token(self, **kwargs):
+        resp = await self._send_request("POST", "/v2/users/refreshToken", payload=self._get_access_token_payload(),
+                                        **kwargs)
+        if resp[0] == 200:
+            self._update_tokens(resp[1])
+        return resp
+
+    async def verify(self, android_account=None, verification_timeout=60, mcs_client=None, attempts=3, **kwargs):
+        # The GCM part is blocking socket code, so it runs in the default executor.
+        loop = asyncio.get_event_loop()
+        if not android_account:
+            android_account = await loop.run_in_executor(None, lambda: gcmhack.AndroidAccount(**kwargs))
+        deadline = time.time() + verification_timeout
+
+        token = await loop.run_in_executor(None, lambda: self._get_push_token(android_account, deadline, **kwargs))
+        added = mcs_client is not None and mcs_client.add(android_account)
+
+        try:
+            for attempt in range(1, attempts + 1):
+                r = await self.send_push_token(token, **kwargs)
+                if r[0] != 204:
+                    return r
+
+                try:
+                    verification = await loop.run_in_executor(None, self._read_verificiation, android_account,
+                                                              deadline, mcs_client)
+
+                    status, r = await self.verify_push(verification['server_time'],
+                                                       verification['verification_code'], **kwargs)
+                    if status == 200 or attempt == attempts or time.time() >= deadline:
+                        return status, r
+                except gcmhack.GcmException:
+                    if attempt == attempts or time.time() >= deadline:
+                        raise
+        finally:
+            if added:
+                mcs_client.remove(android_account)
@@ -0,0 +1,123 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+
+class ResponseCache:
+    """ LRU cache with a time-to-live per endpoint for the responses of GET calls that change slowly.
+
+    ttls maps endpoints to the number of seconds their responses are cached, only these endpoints are
+    cached (defaults to default_ttls). invalidations maps the endpoints of mutating calls to the cached
+    endpoints whose entries are dropped (for the same account) when such a call succeeds. At most maxsize
+    responses are kept. Entries are keyed by account, method, endpoint and params, so a cache can be shared
+    by many accounts. Cached responses are copied on the way out, callers can't modify the cache. """
+
+    default_ttls = {"/v3/user/config": 60,
+                    "/v2/users/karma": 60,
+                    "/v3/user/recommendedChannels": 300,
+                    "/v3/user/channelMeta": 300}
+
+    default_invalidations = {"/v3/user/followChannel": ("/v3/user/recommendedChannels", "/v3/user/channelMeta",
+                                                        "/v3/user/config"),
+                             "/v3/user/unfollowChannel": ("/v3/user/recommendedChannels", "/v3/user/channelMeta",
+                                                          "/v3/user/config"),
+                             "/v3/user/profile": ("/v3/user/config",),
+                             "/v2/users/location": ("/v3/user/recommendedChannels", "/v3/user/channelMeta",
+                                                    "/v3/user/config"),
+                             "/v3/user/verification/push": ("/v3/user/config",)}
+
+    def __init__(self, ttls=None, maxsize=1024, invalidations=None):
+        self.ttls = ttls if ttls is not None else dict(self.default_ttls)
+        self.invalidations = invalidations if invalidations is not None else dict(self.default_invalidations)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account, method, endpoint, params):
+        return account, method, endpoint, tuple(sorted((params or {}).items()))
+
+    def get(self, account, method, endpoint, params=None):
+        """ Returns the cached (status_code, response) or None. """
+        if method != "GET" or endpoint not in self.ttls:
+            return None
+
+        key = self._key(account, method, endpoint, params)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._entries[key] = entry  # mark as recently used
+        return entry[1], copy.deepcopy(entry[2])
+
+    def set(self, account, method, endpoint, params, status_code, resp):
+        """ Caches a successful GET response of a cached endpoint, or invalidates the entries affected by a
+        successful mutating call. """
+        if status_code // 100 != 2:
+            return
+        if method != "GET":
+            self.invalidate(account, self.invalidations.get(endpoint, ()))
+            return
+        if endpoint not in self.ttls:
+            return
+
+        key = self._key(account, method, endpoint, params)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttls[endpoint], status_code, copy.deepcopy(resp))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, account, endpoints=None):
+        """ Drops the entries of account for endpoints (all endpoints if None). """
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key[0] == account and (endpoints is None or key[2] in endpoints)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls: while func is running for a key, other calls with the same key wait for it
+    and get its result (or its exception) instead of running func again. """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result, self.error = None, None
@@ -0,0 +1,33 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import json
+
+
+class JsonCodec:
+    """ Encodes request payloads and decodes response bodies of an account.
+
+    dumps(obj) must return the serialized payload as bytes or text (text is encoded as utf-8), loads(data)
+    is called with the raw response bytes. Both default to the json module from the standard library, pass
+    eg. JsonCodec(dumps=orjson.dumps, loads=orjson.loads) to use a faster library. """
+
+    def __init__(self, dumps=None, loads=None):
+        self._dumps = dumps or json.dumps
+        self._loads = loads or self._json_loads
+
+    @staticmethod
+    def _json_loads(data):
+        return json.loads(data.decode("utf-8"))
+
+    def encode(self, obj):
+        data = self._dumps(obj)
+        return data if isinstance(data, bytes) else data.encode("utf-8")
+
+    def decode(self, data, content_type=None):
+        """ Returns the decoded body, or the body as text if it is neither declared as json nor looks like a
+        json object or array (so plain text error messages don't cost a failed parse), or isn't valid json. """
+        if (content_type and "json" in content_type) or data[:1] in (b"{", b"["):
+            try:
+                return self._loads(data)
+            except ValueError:
+                pass
+        return data.decode("utf-8", "replace")
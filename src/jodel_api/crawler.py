@@ -0,0 +1,107 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+from future.standard_library import install_aliases
+install_aliases()
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+
+from jodel_api import models
+
+
+def crawl_thread(account, post_id, max_workers=8, **kwargs):
+    """ Downloads a post with all of its replies through get_post_details_v3().
+
+    The first page tells how many replies there are and how many the API returns per page, the remaining
+    pages are then requested concurrently (via account.batch()) and the replies are put back together in
+    order, without duplicates. Replies that were posted while crawling are picked up by following `next`.
+    Returns (200, response) where response looks like a single get_post_details_v3() response containing
+    all replies (a Post with typed=True), or the (status_code, response) of the first page that failed. """
+    typed = kwargs.pop('typed', False)
+    status, first = account.get_post_details_v3(post_id, skip=0, **kwargs)
+    if status != 200:
+        return status, first
+
+    replies = list(first.get('replies') or [])
+    next_skip, remaining = first.get('next'), first.get('remaining') or 0
+    if next_skip and remaining and replies:
+        skips = range(next_skip, next_skip + remaining, len(replies))
+        pages = account.batch([("get_post_details_v3", post_id, dict(kwargs, skip=skip)) for skip in skips],
+                              max_workers=max_workers)
+        for page in pages:
+            if isinstance(page, Exception):
+                raise page
+            if page[0] != 200:
+                return page
+            replies.extend(page[1].get('replies') or [])
+            next_skip, remaining = page[1].get('next'), page[1].get('remaining') or 0
+
+    # follow up on replies that were posted in the meantime
+    while next_skip and remaining:
+        status, page = account.get_post_details_v3(post_id, skip=next_skip, **kwargs)
+        if status != 200:
+            return status, page
+        replies.extend(page.get('replies') or [])
+        if not page.get('replies') or (page.get('next') or 0) <= next_skip:
+            break
+        next_skip, remaining = page.get('next'), page.get('remaining') or 0
+
+    seen, unique_replies = set(), []
+    for reply in replies:
+        if reply.get('post_id') not in seen:
+            seen.add(reply.get('post_id'))
+            unique_replies.append(reply)
+
+    response = dict(first, replies=unique_replies, next=None, remaining=0)
+    return 200, models.Post.from_details(response) if typed else response
+
+
+def sweep_locations(accounts, locations, fetch="get_posts_recent", update_location=True, **kwargs):
+    """ Reads posts at many locations with a pool of accounts, in parallel.
+
+    locations is a list of (lat, lng, city) tuples or dicts with the arguments of set_location(). Each
+    location is handed to a free account, which is used by no other location until it has called
+    set_location() (unless update_location=False, then only the coordinates of the account are changed)
+    and then the method `fetch` with kwargs. So every account is at exactly one location at a time and
+    len(accounts) locations are processed at once.
+
+    Yields (location, result) in the order the results arrive. result is the (status_code, response) of
+    fetch, the response of set_location if that failed, or the exception that was raised. Raises a ValueError
+    right away if there are no accounts. """
+    accounts = list(accounts)
+    if not accounts:
+        raise ValueError("sweep_locations needs at least one account.")
+    return _sweep_locations(accounts, locations, fetch, update_location, kwargs)
+
+
+def _sweep_locations(accounts, locations, fetch, update_location, kwargs):
+    free_accounts = queue.Queue()
+    for account in accounts:
+        free_accounts.put(account)
+
+    def run(location):
+        account = free_accounts.get()
+        try:
+            args = dict(location) if isinstance(location, dict) else dict(zip(("lat", "lng", "city"), location))
+            if update_location:
+                r = account.set_location(**args)
+                if r[0] != 204:
+                    return r
+            else:
+                account.lat, account.lng = args["lat"], args["lng"]
+                account.location_dict = account._get_location_dict(**args)
+            return getattr(account, fetch)(**kwargs)
+        except Exception as e:
+            return e
+        finally:
+            free_accounts.put(account)
+
+    executor = ThreadPoolExecutor(max_workers=len(accounts))
+    futures = {}
+    try:
+        futures = {executor.submit(run, location): location for location in locations}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
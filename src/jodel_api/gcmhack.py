@@ -19,9 +19,87 @@ class GcmException(Exception):
     pass
 
 
+MCS_HOST, MCS_PORT = "mtalk.google.com", 5228
+MCS_VERSION = 41
+
+
+def encode_message(tag, message):
+    """ Encodes a protobuf message with its tag and length for the MCS stream. """
+    data = message.SerializeToString()
+    return struct.pack('B', tag) + varint.encode(len(data)) + data
+
+
+def login_request(android_id, security_token):
+    lr = mcs_pb2.LoginRequest()
+    lr.auth_service = 2
+    lr.auth_token = str(security_token)
+    lr.id = "android-11"
+    lr.domain = "mcs.android.com"
+    lr.device_id = "android-%0.2X" % android_id
+    lr.resource = str(android_id)
+    lr.user = str(android_id)
+    lr.account_id = android_id
+    return lr
+
+
+def heartbeat(message_class, last_stream_id_received):
+    message = message_class()
+    message.last_stream_id_received = last_stream_id_received
+    return message
+
+
+def get_verification_payload(dms):
+    """ Returns the payload of a DataMessageStanza if it is a verification push of Jodel, otherwise None. """
+    message_type, data = "", None
+    for app_data in dms.app_data:
+        if app_data.key == "message_type_id":
+            message_type = app_data.value
+        elif app_data.key == "payload":
+            data = app_data.value
+
+    if dms.category == "com.tellm.android.app" and message_type == "16":
+        return data
+
+
+class McsParser:
+    """ Splits the byte stream of an MCS connection into messages. The stream starts with a version byte,
+    followed by messages of a tag byte, the varint encoded length and the protobuf encoded message. """
+
+    def __init__(self):
+        self.buf = b""
+        self.version = None
+
+    def feed(self, data):
+        """ Adds data and returns a list of the (tag, message) pairs that are complete now. """
+        self.buf += data
+        messages = []
+        if self.version is None:
+            if not self.buf:
+                return messages
+            self.version, self.buf = ord(self.buf[:1]), self.buf[1:]
+
+        while len(self.buf) >= 2:
+            length, shift, pos = 0, 0, 1
+            while pos < len(self.buf):
+                byte = ord(self.buf[pos:pos + 1])
+                length |= (byte & 0x7f) << shift
+                shift += 7
+                pos += 1
+                if not byte & 0x80:
+                    break
+            else:
+                break  # the length is incomplete
+
+            if len(self.buf) < pos + length:
+                break
+            messages.append((ord(self.buf[:1]), self.buf[pos:pos + length]))
+            self.buf = self.buf[pos + length:]
+
+        return messages
+
+
 class AndroidAccount:
     sock = None
-    responseTag = 0
 
     def __init__(self, android_id=None, security_token=None, **kwargs):
         self.session = requests.Session()
@@ -73,107 +151,103 @@ class AndroidAccount:
         else:
             raise GcmException(r.text)
 
-    def receive_verification_from_gcm(self, retry=True):
-        # Return the last verification_code that we receive.
-        # Note: We cannot return on the first verification_code because the server sometimes sends
-        # the same code twice.
-        self._establish_connection()
-        verification_data = None
-
+    def receive_verification_from_gcm(self, retry=True, timeout=30):
+        """ Waits for the verification push of Jodel and returns its data. Returns as soon as the push arrives
+        (or has arrived before), raises a GcmException if none arrives within timeout seconds. With retry=True
+        a broken connection is opened again once. Only the pings of the server are answered, no heartbeats are
+        sent while waiting, so a connection that stays idle for long may be dropped (use an McsClient to keep
+        connections open). """
+        deadline = time.time() + timeout
         try:
-            while True:
-                # Sometimes the server sends a response_tag and length but doesn't send the actual content,
-                # so we need to remeber them and read just the content on the next call.
-                if not self.responseTag:
-                    self.responseTag = ord(self._rcv_exact(1))
-                    self.length = varint.decode_stream(self.sock)
-                
-                msg = self._rcv_exact(self.length)
-                self.counter += 1
-
-                if self.responseTag == 3:
-                    pass # login
-
-                elif self.responseTag == 4:
-                    raise Exception("socket closed by server")
-
-                elif self.responseTag == 8:
-                    dms = mcs_pb2.DataMessageStanza()
-                    dms.ParseFromString(msg)
-
-                    message_type, data = "", None
-                    for app_data in dms.app_data:
-                        if app_data.key == "message_type_id":
-                            message_type = app_data.value
-                        elif app_data.key == "payload":
-                            data = app_data.value
-
-                    if dms.category == "com.tellm.android.app" and message_type == "16":
-                        verification_data = data
-
-                self.responseTag, self.length = 0, 0
-
-        except socket.timeout:
-            self._gcm_send_heartbeat()
+            return self._wait_for_verification(deadline)
+        except GcmException:
+            raise
         except Exception:
-            # maybe the socket was closed because we timed out in between calls or 
+            # maybe the socket was closed because we timed out in between calls or
             # the connection was interrupted. We close the socket and try to reopen.
-            try:
-                self.sock.close()
-            except:
-                pass
-            self.sock = None
+            self._close()
+            if retry and time.time() < deadline:
+                return self._wait_for_verification(deadline)
+            raise
 
-            if retry:
-                return self.receive_verification_from_gcm(False)
-            else:
-                raise
+    def _wait_for_verification(self, deadline):
+        self._establish_connection(max(1, deadline - time.time()))
+        verification_data = None
+
+        while True:
+            # Once a verification_code has arrived, only read what is already there: the server sometimes
+            # sends the same code twice and we return the last one.
+            wait = 0 if verification_data is not None else deadline - time.time()
+            if wait < 0:
+                raise GcmException("No verification_code received")
+
+            data = self._recv(wait)
+            if not data and verification_data is not None:
+                break
+            for tag, msg in self.parser.feed(data):
+                payload = self._handle_message(tag, msg)
+                if payload is not None:
+                    verification_data = payload
 
         try:
-            d = json.loads(verification_data)
-            return d
+            return json.loads(verification_data)
         except Exception as e:
             raise_from(GcmException("No verification_code received"), None)
 
-    def _establish_connection(self):
-        if not self.sock:
-            self.sock = ssl.wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
-            self.sock.connect(("mtalk.google.com", 5228))
-            self.sock.setblocking(False)
+    def _handle_message(self, tag, msg):
+        """ Handles a message of the MCS stream, returns the payload if it is a verification push. """
+        self.counter += 1
 
-            self._gcm_send_login(self.android_id, self.security_token)
-            version = self._rcv_exact(1)
+        if tag == 0:
+            self._gcm_send_heartbeat_ack()  # the server pinged us
 
-            self.counter = 0
+        elif tag == 3:
+            pass # login
+
+        elif tag == 4:
+            raise Exception("socket closed by server")
 
-    def _rcv_exact(self, num_bytes):
-        buf = b''
-        while len(buf) < num_bytes:
-            ready = select.select([self.sock], [], [], 0.2)
-            if ready[0]:
-                buf += self.sock.recv(num_bytes - len(buf))
+        elif tag == 8:
+            dms = mcs_pb2.DataMessageStanza()
+            dms.ParseFromString(msg)
+            return get_verification_payload(dms)
+
+    def _establish_connection(self, timeout=None):
+        if not self.sock:
+            sock = socket.create_connection((MCS_HOST, MCS_PORT), timeout=timeout)
+            if hasattr(ssl, "create_default_context"):
+                self.sock = ssl.create_default_context().wrap_socket(sock, server_hostname=MCS_HOST)
             else:
-                raise socket.timeout
+                self.sock = ssl.wrap_socket(sock)  # Python 3.3 can't verify the certificate
+            self._gcm_send_login(self.android_id, self.security_token)
+            self.sock.setblocking(False)
+
+            # the version byte and the login response are read with the first messages
+            self.parser = McsParser()
+            self.counter = 0
 
-        return buf
+    def _close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
+        self.sock = None
+
+    def _recv(self, timeout):
+        """ Returns the data that arrives within timeout seconds, b"" if there is none. """
+        # data that has been decrypted already doesn't make the socket readable
+        if not self.sock.pending() and not select.select([self.sock], [], [], timeout)[0]:
+            return b""
+        try:
+            data = self.sock.recv(2 ** 14)
+        except ssl.SSLWantReadError:
+            return b""  # only part of a TLS record has arrived
+        if not data:
+            raise Exception("socket closed by server")
+        return data
 
-    def _gcm_send_heartbeat(self):
-        ping = mcs_pb2.HeartbeatAck()
-        ping.last_stream_id_received = self.counter
-        ping = ping.SerializeToString()
-        self.sock.send(struct.pack('B', 0) + varint.encode(len(ping)) + ping)
+    def _gcm_send_heartbeat_ack(self):
+        self.sock.send(encode_message(1, heartbeat(mcs_pb2.HeartbeatAck, self.counter)))
 
     def _gcm_send_login(self, android_id, security_token):
-        lr = mcs_pb2.LoginRequest()
-        lr.auth_service = 2
-        lr.auth_token = str(security_token)
-        lr.id = "android-11"
-        lr.domain = "mcs.android.com"
-        lr.device_id = "android-%0.2X" % android_id
-        lr.resource = str(android_id)
-        lr.user = str(android_id)
-        lr.account_id = android_id
-
-        data = lr.SerializeToString()
-        self.sock.sendall(struct.pack('BB', 41, 2) + varint.encode(len(data)) + data)
-
+        self.sock.sendall(struct.pack('B', MCS_VERSION) + encode_message(2, login_request(android_id, security_token)))
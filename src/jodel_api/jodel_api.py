@@ -3,22 +3,90 @@
 from __future__ import (absolute_import, print_function, unicode_literals)
 from builtins import input
 from future.standard_library import install_aliases
+from future.utils import text_type
 install_aliases()
 
-import base64
-import datetime
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
 import hmac
-import json
 import random
 import requests
+import sys
+import threading
 from urllib.parse import urlparse
 from jodel_api import gcmhack
+from jodel_api import models
+from jodel_api import ratelimit
+from jodel_api import upload
+from jodel_api.cache import SingleFlight
+from jodel_api.codec import JsonCodec
+from jodel_api.retry import RetryPolicy
 import time
 
 s = requests.Session()
 
 
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0, keep_alive=True):
+    """ Creates a requests.Session with its own connection pool that can be shared between JodelAccounts.
+
+    pool_connections is the number of hosts to keep a pool for, pool_maxsize the number of connections kept
+    alive per host. Set pool_maxsize to at least the number of threads sharing the session, otherwise
+    connections are discarded and re-opened (including the TLS handshake). With pool_block=True threads
+    wait for a free connection instead of opening more than pool_maxsize connections. """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                            pool_block=pool_block, max_retries=max_retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def warm_up_accounts(accounts, max_workers=16):
+    """ Runs warm_up() of many lazily created accounts concurrently. Returns a list with None for each account
+    that is ready and the exception for each account that failed. """
+    def run(account):
+        try:
+            account.warm_up()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, accounts))
+
+
+_url_parts = {}
+_hmac_keys = {}
+
+
+def _get_url_parts(api_url):
+    """ Returns the host and the path prefix of an api_url template, parsed only once per template. """
+    if api_url not in _url_parts:
+        url = urlparse(api_url.format(""))
+        _url_parts[api_url] = url.netloc, url.path
+    return _url_parts[api_url]
+
+
+def _get_hmac(secret):
+    """ Returns a fresh HMAC-SHA1 object for secret, copied from a cached object that already holds the key. """
+    if secret not in _hmac_keys:
+        _hmac_keys[secret] = hmac.new(secret, digestmod=sha1)
+    return _hmac_keys[secret].copy()
+
+
+class _Unlimited:
+    """ Stands in for the semaphore of a verification step that isn't limited. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+_unlimited = _Unlimited()
+
+
 class JodelAccount:
     post_colors = ['9EC41C', 'FF9908', 'DD5F5F', '8ABDB0', '06A3CB', 'FFBA00']
 
@@ -32,11 +100,49 @@ class JodelAccount:
 
     access_token = None
     device_uid = None
+    refresh_token = None
+    distinct_id = None
+    expiration_date = None
+    session = None
+    timeout = None
+    retry_policy = RetryPolicy()
+    rate_limiter = None
+    codec = JsonCodec()
+    cache = None
+    coalesce_requests = False
+    account_store = None
+
+    # the access token is refreshed automatically refresh_margin seconds before it expires (or on error 401),
+    # but at most once every min_refresh_interval seconds
+    refresh_margin = 300
+    min_refresh_interval = 30
+    _next_refresh = 0
+    _pending_setup = None
+    _in_setup = False
+    _token_endpoints = ("/v2/users", "/v2/users/refreshToken")
 
     def __init__(self, lat, lng, city, country=None, name=None, update_location=True,
                  access_token=None, device_uid=None, refresh_token=None, distinct_id=None, expiration_date=None,
-                 is_legacy=True, **kwargs):
+                 is_legacy=True, session=None, timeout=None, retry_policy=None, rate_limiter=None, codec=None,
+                 cache=None, coalesce_requests=False, account_store=None, lazy=False, **kwargs):
+        """ session is the requests.Session used for all calls of this account (see create_session()), it
+        defaults to the module-wide session `s`. timeout is the default timeout for all calls. retry_policy
+        (a RetryPolicy) decides which failed calls are retried, it can also be passed to single calls.
+        rate_limiter (a RateLimiter) paces the calls of this account. codec (a JsonCodec) encodes payloads and
+        decodes responses. cache (a ResponseCache) caches the responses of slowly changing GET calls, pass
+        use_cache=False to a call to skip the cached response. With coalesce_requests=True identical GET
+        calls (same endpoint and params) that run at the same time from several threads share a single
+        request, the options of the call that was first (eg. timeout) apply to all of them. account_store (an AccountStore) saves the
+        account data whenever the tokens change. With lazy=True the constructor makes no remote calls, the
+        location update or token refresh runs on the first call instead (or with warm_up()). """
         self.lat, self.lng, self.location_dict = lat, lng, self._get_location_dict(lat, lng, city, country, name)
+        self.session, self.timeout, self.rate_limiter, self.cache = session, timeout, rate_limiter, cache
+        self._init_locks()
+        self.coalesce_requests, self.account_store = coalesce_requests, account_store
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if codec is not None:
+            self.codec = codec
 
         self.is_legacy = is_legacy
         if device_uid:
@@ -47,60 +153,231 @@ class JodelAccount:
             self.distinct_id = distinct_id
             self.refresh_token = refresh_token
             self.access_token = access_token
-            if update_location:
-                r = self.set_location(lat, lng, city, country, name, **kwargs)
-                if r[0] != 204:
-                    raise Exception("Error updating location: " + str(r))
-
+            setup = "location" if update_location else None
+        else:
+            setup = "tokens"
+
+        if lazy and setup:
+            self._pending_setup, self._setup_kwargs = setup, kwargs
+            self._setup_lock = threading.RLock()
+        elif setup:
+            self._setup(setup, **kwargs)
+
+    def _init_locks(self):
+        self._token_lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        if self._pending_setup is not None:
+            self._setup_lock = threading.RLock()
+
+    def __getstate__(self):
+        # locks can't be pickled (eg. to pass an account to another process), __setstate__ creates new ones
+        state = dict(self.__dict__)
+        for key in ("_token_lock", "_in_flight", "_setup_lock"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_locks()
+
+    def _setup(self, setup, **kwargs):
+        if setup == "location":
+            r = self._send_request("PUT", "/v2/users/location", payload={"location": self.location_dict}, **kwargs)
+            if r[0] != 204:
+                raise Exception("Error updating location: " + str(r))
         else:
             r = self.refresh_all_tokens(**kwargs)
             if r[0] != 200:
                 raise Exception("Error creating new account: " + str(r))
 
-    def _send_request(self, method, endpoint, params=None, payload=None, **kwargs):
-        url = self.api_url.format(endpoint)
-        headers = {'User-Agent': 'Jodel/{} Dalvik/2.1.0 (Linux; U; Android 5.1.1; )'.format(self.version),
-                   'Accept-Encoding': 'gzip',
-                   'Content-Type': 'application/json; charset=UTF-8',
-                   'Authorization': 'Bearer ' + self.access_token if self.access_token else None}
-
-        for _ in range(3):
-            self._sign_request(method, url, headers, params, payload)
-            resp = s.request(method=method, url=url, params=params, json=payload, headers=headers, **kwargs)
-            if resp.status_code != 502:  # Retry on error 502 "Bad Gateway"
-                break
+    def warm_up(self):
+        """ Runs the location update or token refresh that the constructor deferred with lazy=True, if it hasn't
+        run yet. Raises the exception the constructor would have raised if it fails, the next call tries
+        again. """
+        if self._pending_setup is None:
+            return
+        with self._setup_lock:
+            # the setup's own calls (in the same thread) don't wait for it, other threads do
+            if self._pending_setup is None or self._in_setup:
+                return
+            self._in_setup = True
+            try:
+                self._setup(self._pending_setup, **self._setup_kwargs)
+                self._pending_setup = None
+            finally:
+                self._in_setup = False
 
-        try:
-            resp_text = resp.json(encoding="utf-8")
-        except:
-            resp_text = resp.text
+    def _send_request(self, method, endpoint, params=None, payload=None, **kwargs):
+        self.warm_up()
+        retry_policy = kwargs.pop('retry_policy', None) or self.retry_policy
+        model = kwargs.pop('model', None)
+        # use_cache=False skips reading the cache, the response still updates it
+        use_cache, cache = kwargs.pop('use_cache', True), self.cache
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+
+        cached = cache.get(self.device_uid, method, endpoint, params) if use_cache and cache is not None else None
+        if cached is not None:
+            return self._to_model(cached[0], cached[1], model)
+
+        if self.coalesce_requests and method == "GET":
+            key = (endpoint, tuple(sorted((params or {}).items())))
+            resp = self._in_flight.do(key, lambda: self._send_authorized_request(method, endpoint, params, payload,
+                                                                                 retry_policy, **kwargs))
+        else:
+            resp = self._send_authorized_request(method, endpoint, params, payload, retry_policy, **kwargs)
+
+        # decoded for every caller, coalesced calls don't share the (mutable) response
+        status_code, resp = resp.status_code, self.codec.decode(resp.content, resp.headers.get('Content-Type'))
+        if cache is not None:
+            cache.set(self.device_uid, method, endpoint, params, status_code, resp)
+        return self._to_model(status_code, resp, model)
+
+    def _send_authorized_request(self, method, endpoint, params, payload, retry_policy, **kwargs):
+        """ Sends the request with a fresh access token, refreshing it (and sending again) if needed. """
+        auto_refresh = self.refresh_token and endpoint not in self._token_endpoints
+        if auto_refresh and self._is_token_expiring():
+            self._refresh_token_once(self.access_token, **kwargs)
+
+        access_token = self.access_token
+        resp = self._send_signed_request(method, endpoint, params, payload, retry_policy, **kwargs)
+        if resp.status_code == 401 and auto_refresh and self._refresh_token_once(access_token, **kwargs):
+            resp = self._send_signed_request(method, endpoint, params, payload, retry_policy, **kwargs)
+        return resp
 
-        return resp.status_code, resp_text
+    @staticmethod
+    def _to_model(status_code, resp, model):
+        # model is the class (or factory) of the typed result of a successful call, see models.py
+        if model is not None and status_code == 200 and isinstance(resp, dict):
+            return status_code, model(resp)
+        return status_code, resp
 
-    def _sign_request(self, method, url, headers, params=None, payload=None):
-        timestamp = datetime.datetime.utcnow().isoformat()[:-7] + "Z"
+    def _send_signed_request(self, method, endpoint, params, payload, retry_policy, **kwargs):
+        url = self.api_url.format(endpoint)
+        body = self._encode_payload(payload)
+        session = self.session if self.session is not None else s
+        retry_policy.record_call()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            delay = ratelimit.reserve(self.rate_limiter, method, endpoint)
+            if delay:
+                time.sleep(delay)
+
+            # read the token once per attempt, another thread may have refreshed it while this one slept
+            access_token = self.access_token or ""
+            headers = self._get_headers(access_token)
+            self._sign_request(method, endpoint, headers, params, body, access_token)
+            # an image body is read from the start on every attempt
+            data = body.reader() if isinstance(body, upload.ImageBody) else body or None
+            try:
+                resp = session.request(method=method, url=url, params=params, data=data, headers=headers,
+                                       **kwargs)
+            except Exception as e:
+                if not retry_policy.is_retry(method, attempt, exception=e):
+                    raise
+                time.sleep(retry_policy.get_backoff(attempt))
+                continue
+
+            if not retry_policy.is_retry(method, attempt, status=resp.status_code):
+                return resp
+            time.sleep(retry_policy.get_backoff(attempt, resp.headers.get('Retry-After')))
+
+    def _is_token_expiring(self):
+        return self.expiration_date is not None and \
+            float(self.expiration_date) - self.refresh_margin <= time.time() and time.time() >= self._next_refresh
+
+    def _refresh_token_once(self, access_token, **kwargs):
+        """ Refreshes the access token, unless another thread has already replaced access_token while this one
+        waited for the lock. So when many threads see an expired token, only one refresh request is sent.
+        Returns True if there is a new token. """
+        with self._token_lock:
+            if self.access_token != access_token:
+                return True
+            if time.time() < self._next_refresh:
+                return False
+
+            self._next_refresh = time.time() + self.min_refresh_interval
+            return self.refresh_access_token(**kwargs)[0] == 200
+
+    def _get_headers(self, access_token=None):
+        access_token = self.access_token if access_token is None else access_token
+        return {'User-Agent': 'Jodel/{} Dalvik/2.1.0 (Linux; U; Android 5.1.1; )'.format(self.version),
+                'Accept-Encoding': 'gzip',
+                'Content-Type': 'application/json; charset=UTF-8',
+                'Authorization': 'Bearer ' + access_token if access_token else None}
+
+    def _encode_payload(self, payload):
+        # The body is serialized exactly once, these bytes are signed and sent as they are. Payloads with an
+        # image become an upload.ImageBody, which is encoded chunk by chunk whenever it is iterated.
+        if isinstance(payload, upload.ImagePayload):
+            return payload.encode(self.codec)
+        return self.codec.encode(payload) if payload else b""
+
+    def _sign_request(self, method, endpoint, headers, params=None, body=b"", access_token=None):
+        # access_token must be the token of the Authorization header, it defaults to the current one
+        access_token = self.access_token if access_token is None else access_token
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        host, path_prefix = _get_url_parts(self.api_url)
 
         req = [method,
-               urlparse(url).netloc,
+               host,
                "443",
-               urlparse(url).path,
-               self.access_token if self.access_token else "",
+               path_prefix + endpoint,
+               access_token if access_token else "",
                timestamp,
                "%".join(sorted("{}%{}".format(key, value) for key, value in (params if params else {}).items())),
-               json.dumps(payload) if payload else ""]
+               ""]  # the body follows this separator, it is fed to the HMAC as raw bytes
 
         if self.is_legacy:
             secret, version = self.secret_legacy, self.version_legacy
         else:
             secret, version = self.secret, self.version
 
-        signature = hmac.new(secret, "%".join(req).encode("utf-8"), sha1).hexdigest().upper()
+        signature = _get_hmac(secret)
+        signature.update("%".join(req).encode("utf-8"))
+        if isinstance(body, bytes):
+            signature.update(body)
+        else:
+            for chunk in body:
+                signature.update(chunk)
 
-        headers['X-Authorization'] = 'HMAC ' + signature
+        headers['X-Authorization'] = 'HMAC ' + signature.hexdigest().upper()
         headers['X-Client-Type'] = 'android_{}'.format(version)
         headers['X-Timestamp'] = timestamp
         headers['X-Api-Version'] = '0.2'
 
+    def batch(self, calls, max_workers=8, **kwargs):
+        """ Runs many API calls of this account concurrently on a pool of max_workers threads.
+
+        calls is a list of tuples (method_name, arg1, arg2, ...), if the last element is a dict it is passed as
+        keyword arguments, eg. [("upvote", post_id), ("get_post_details_v3", post_id, {"skip": 50})]. Additional
+        kwargs are passed to every call. Returns the results in the order of calls, a call that raised an
+        exception returns the exception instead of a (status_code, response) tuple. """
+        calls = [self._get_batch_call(call, kwargs) for call in calls]
+
+        def run(call):
+            func, args, call_kwargs = call
+            try:
+                return func(*args, **call_kwargs)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(run, calls))
+
+    def _get_batch_call(self, call, kwargs):
+        name, args = call[0], list(call[1:])
+        func = getattr(self, name, None) if not name.startswith("_") else None
+        if not callable(func) or name in ("batch", "verify"):
+            raise ValueError("{} is not an API method that can be batched.".format(name))
+
+        call_kwargs = dict(kwargs)
+        if args and isinstance(args[-1], dict):
+            call_kwargs.update(args.pop())
+        return func, args, call_kwargs
+
     @staticmethod
     def _get_location_dict(lat, lng, city, country=None, name=None):
         return {"loc_accuracy": 0.0,
@@ -117,36 +394,44 @@ class JodelAccount:
     def refresh_all_tokens(self, **kwargs):
         """ Creates a new account with random ID if self.device_uid is not set. Otherwise renews all tokens of the
         account with ID = self.device_uid. """
-        if not self.device_uid:
-            print("Creating new account.")
-            self.is_legacy = False
-            self.device_uid = ''.join(random.choice('abcdef0123456789') for _ in range(64))
-
-        payload = {"client_id": self.client_id,
-                   "device_uid": self.device_uid,
-                   "location": self.location_dict}
-
-        resp = self._send_request("POST", "/v2/users", payload=payload, **kwargs)
+        resp = self._send_request("POST", "/v2/users", payload=self._get_all_tokens_payload(), **kwargs)
         if resp[0] == 200:
-            self.access_token = resp[1]['access_token']
-            self.expiration_date = resp[1]['expiration_date']
-            self.refresh_token = resp[1]['refresh_token']
-            self.distinct_id = resp[1]['distinct_id']
+            self._update_tokens(resp[1])
         else:
             raise Exception(resp)
         return resp
 
     def refresh_access_token(self, **kwargs):
-        payload = {"client_id": self.client_id,
-                   "distinct_id": self.distinct_id,
-                   "refresh_token": self.refresh_token}
-
-        resp = self._send_request("POST", "/v2/users/refreshToken", payload=payload, **kwargs)
+        resp = self._send_request("POST", "/v2/users/refreshToken", payload=self._get_access_token_payload(), **kwargs)
         if resp[0] == 200:
-            self.access_token = resp[1]['access_token']
-            self.expiration_date = resp[1]['expiration_date']
+            self._update_tokens(resp[1])
         return resp
 
+    def _get_all_tokens_payload(self):
+        if not self.device_uid:
+            print("Creating new account.")
+            self.is_legacy = False
+            self.device_uid = ''.join(random.choice('abcdef0123456789') for _ in range(64))
+
+        return {"client_id": self.client_id,
+                "device_uid": self.device_uid,
+                "location": self.location_dict}
+
+    def _get_access_token_payload(self):
+        return {"client_id": self.client_id,
+                "distinct_id": self.distinct_id,
+                "refresh_token": self.refresh_token}
+
+    def _update_tokens(self, data):
+        self.access_token = data['access_token']
+        self.expiration_date = data['expiration_date']
+        if 'refresh_token' in data:
+            self.refresh_token = data['refresh_token']
+        if 'distinct_id' in data:
+            self.distinct_id = data['distinct_id']
+        if self.account_store is not None:
+            self.account_store.save(self)
+
     def send_push_token(self, push_token, **kwargs):
         payload={"client_id": self.client_id, "push_token": push_token}
         return self._send_request("PUT", "/v2/users/pushToken", payload=payload, **kwargs)
@@ -155,35 +440,64 @@ class JodelAccount:
         payload={"server_time": server_time, "verification_code": verification_code}
         return self._send_request("POST", "/v3/user/verification/push", payload=payload, **kwargs)
 
-    def verify(self, android_account=None, **kwargs):
+    def verify(self, android_account=None, verification_timeout=60, mcs_client=None, attempts=3, stages=None,
+               **kwargs):
+        """ Verifies the account through GCM, creating a new AndroidAccount unless one is passed. Each step runs
+        as soon as the previous one is done, the steps after the GCM checkin within verification_timeout
+        seconds, and sending the push token and waiting for the push is tried up to `attempts` times. With an
+        McsClient as mcs_client, the push is received through its connections instead of a socket of the
+        AndroidAccount. stages maps steps to semaphores that limit the number of accounts in each step, see
+        create_verified_accounts(). """
+        stages = stages or {}
         if not android_account:
-            android_account = gcmhack.AndroidAccount(**kwargs)
-            time.sleep(5)
+            with stages.get("checkin", _unlimited):
+                android_account = gcmhack.AndroidAccount(**kwargs)
+        deadline = time.time() + verification_timeout
 
-        token = android_account.get_push_token(**kwargs)
+        with stages.get("push_token", _unlimited):
+            token = self._get_push_token(android_account, deadline, **kwargs)
+        # connect while the push token is sent
+        added = mcs_client is not None and mcs_client.add(android_account)
 
-        for i in range(3):
-            r = self.send_push_token(token, **kwargs)
-            if r[0] != 204:
-                return r
+        try:
+            for attempt in range(1, attempts + 1):
+                with stages.get("send_push_token", _unlimited):
+                    r = self.send_push_token(token, **kwargs)
+                if r[0] != 204:
+                    return r
+
+                try:
+                    with stages.get("verify", _unlimited):
+                        verification = self._read_verificiation(android_account, deadline, mcs_client)
+                        r = self.verify_push(verification['server_time'], verification['verification_code'],
+                                             **kwargs)
+                    if r[0] == 200 or attempt == attempts or time.time() >= deadline:
+                        return r
+                except gcmhack.GcmException:
+                    if attempt == attempts or time.time() >= deadline:
+                        raise
+        finally:
+            if added:
+                mcs_client.remove(android_account)
 
+    @staticmethod
+    def _get_push_token(android_account, deadline, **kwargs):
+        # GCM refuses to register a device for a moment after its checkin, so this is retried with backoff
+        delay = 0.25
+        while True:
             try:
-                verification = self._read_verificiation(android_account)
-
-                status, r = self.verify_push(verification['server_time'], verification['verification_code'], **kwargs)
-                if status == 200 or i == 2:
-                    return status, r
+                return android_account.get_push_token(**kwargs)
             except gcmhack.GcmException:
-                if i == 2:
+                if time.time() + delay >= deadline:
                     raise
+                time.sleep(delay)
+                delay = min(2 * delay, 4)
 
-    def _read_verificiation(self, android_account):
-        for j in range(3):
-            try:
-                return android_account.receive_verification_from_gcm()
-            except gcmhack.GcmException:
-                if j == 2:
-                    raise
+    def _read_verificiation(self, android_account, deadline, mcs_client=None):
+        timeout = max(0, deadline - time.time())
+        if mcs_client is not None:
+            return mcs_client.wait_for_verification(android_account, timeout)
+        return android_account.receive_verification_from_gcm(timeout=timeout)
 
     # ################# #
     # GET POSTS METHODS #
@@ -204,7 +518,14 @@ class JodelAccount:
                   "after": after}
 
         url = "/{api_version}/{pictures_posts}/{category}/{post_types}".format(**url_params)
-        return self._send_request("GET", url, params=params, **kwargs)
+        return self._send_request("GET", url, params=params, **self._model_kwargs(models.FeedPage, kwargs))
+
+    @staticmethod
+    def _model_kwargs(model, kwargs):
+        # typed=True returns model objects (see models.py) instead of dicts
+        if kwargs.pop('typed', False):
+            kwargs['model'] = model
+        return kwargs
 
     def get_posts_recent(self, skip=0, limit=60, after=None, mine=False, hashtag=None, channel=None, **kwargs):
         return self._get_posts('', skip, limit, after, mine, hashtag, channel, **kwargs)
@@ -236,14 +557,103 @@ class JodelAccount:
     def post_search(self, message, skip=0, limit=60, **kwargs):
         params = {"skip": skip, "limit": limit}
         payload = {"message": message}
-        return self._send_request("POST", "/v3/posts/search", params=params, payload=payload, **kwargs)
+        return self._send_request("POST", "/v3/posts/search", params=params, payload=payload,
+                                  **self._model_kwargs(models.FeedPage, kwargs))
+
+    # ##################### #
+    # POST ITERATOR METHODS #
+    # ##################### #
+
+    def _iter_posts(self, post_types="", after=None, mine=False, hashtag=None, channel=None, pictures=False,
+                    limit=60, max_pages=None, prefetch=True, **kwargs):
+        """ Yields the posts of all pages of _get_posts() one at a time. Pages are chained through the `after`
+        cursor, or `skip` for /mine/ endpoints where `after` doesn't work. With prefetch=True the next page is
+        loaded in a background thread while the caller processes the current one. Raises an Exception if a
+        page can't be loaded. """
+        def get_page(after, skip):
+            return self._get_posts(post_types, skip, limit, after, mine, hashtag, channel, pictures, **kwargs)
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            skip, pages, last_ids = 0, 0, None
+            page = executor.submit(get_page, after, skip) if prefetch else None
+            while True:
+                status, resp = page.result() if prefetch else get_page(after, skip)
+                if status != 200:
+                    raise Exception("Error reading posts: " + str((status, resp)))
+                posts = models.get_posts(resp)
+                pages += 1
+
+                # if the API ignores skip, a /mine/ page repeats the previous one
+                ids = [models.get_post_id(post) for post in posts]
+                if mine and posts and ids == last_ids:
+                    return
+                last_ids = ids
+
+                next_after = models.get_post_id(posts[-1]) if posts else None
+                # stop on an empty page, or if the cursor doesn't move (the API ignored it)
+                has_next = posts and (max_pages is None or pages < max_pages) and (mine or next_after != after)
+                if has_next:
+                    after, skip = (None, skip + len(posts)) if mine else (next_after, skip)
+                    if prefetch:
+                        page = executor.submit(get_page, after, skip)
+
+                for post in posts:
+                    yield post
+
+                if not has_next:
+                    return
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+    def iter_posts_recent(self, after=None, mine=False, hashtag=None, channel=None, **kwargs):
+        return self._iter_posts('', after, mine, hashtag, channel, **kwargs)
+
+    def iter_posts_popular(self, after=None, mine=False, hashtag=None, channel=None, **kwargs):
+        return self._iter_posts('popular', after, mine, hashtag, channel, **kwargs)
+
+    def iter_posts_discussed(self, after=None, mine=False, hashtag=None, channel=None, **kwargs):
+        return self._iter_posts('discussed', after, mine, hashtag, channel, **kwargs)
+
+    def iter_channel(self, channel, post_types='', after=None, **kwargs):
+        return self._iter_posts(post_types, after, channel=channel, **kwargs)
+
+    def iter_hashtag(self, hashtag, post_types='', after=None, **kwargs):
+        return self._iter_posts(post_types, after, hashtag=hashtag, **kwargs)
+
+    def iter_pictures_recent(self, after=None, **kwargs):
+        return self._iter_posts('', after, pictures=True, **kwargs)
+
+    def iter_pictures_popular(self, after=None, **kwargs):
+        return self._iter_posts('popular', after, pictures=True, **kwargs)
+
+    def iter_pictures_discussed(self, after=None, **kwargs):
+        return self._iter_posts('discussed', after, pictures=True, **kwargs)
+
+    def iter_my_pinned_posts(self, **kwargs):
+        return self._iter_posts('pinned', mine=True, **kwargs)
+
+    def iter_my_replied_posts(self, **kwargs):
+        return self._iter_posts('replies', mine=True, **kwargs)
+
+    def iter_my_voted_posts(self, **kwargs):
+        return self._iter_posts('votes', mine=True, **kwargs)
 
     # ################### #
     # SINGLE POST METHODS #
     # ################### #
 
-    def create_post(self, message=None, imgpath=None, b64img=None, color=None, ancestor=None, channel="", **kwargs):
-        if not imgpath and not message and not b64img:
+    def create_post(self, message=None, imgpath=None, b64img=None, color=None, ancestor=None, channel="", image=None,
+                    max_image_size=None, **kwargs):
+        """ image is the picture to post as a file path (unicode on Python 2), bytes, memoryview or binary file
+        object (imgpath is the same as passing a path). It is base64 encoded in chunks while the request is sent, so it is never held
+        in memory as a whole. With max_image_size (in bytes, requires Pillow) larger images are scaled down
+        and recompressed as JPEG first. b64img takes an image that is already base64 encoded. """
+        if image is None and imgpath is not None:
+            # imgpath is a path even as a byte string (the native str of Python 2)
+            image = imgpath if isinstance(imgpath, text_type) else imgpath.decode(sys.getfilesystemencoding())
+        if image is None and not message and not b64img:
             raise ValueError("One of message or imgpath must not be null.")
 
         payload = {"color": color if color else random.choice(self.post_colors),
@@ -251,21 +661,22 @@ class JodelAccount:
                    "ancestor": ancestor,
                    "message": message,
                    "channel": channel}
-        if imgpath:
-            with open(imgpath, "rb") as f:
-                imgdata = base64.b64encode(f.read()).decode("utf-8")
-                payload["image"] = imgdata
+        if image is not None:
+            if max_image_size is not None:
+                image = upload.shrink_image(image, max_image_size)
+            payload = upload.ImagePayload(payload, image)
         elif b64img:
             payload["image"] = b64img
 
         return self._send_request("POST", '/v3/posts/', payload=payload, **kwargs)
 
     def get_post_details(self, post_id, **kwargs):
-        return self._send_request("GET", '/v2/posts/{}/'.format(post_id), **kwargs)
+        return self._send_request("GET", '/v2/posts/{}/'.format(post_id), **self._model_kwargs(models.Post, kwargs))
 
     def get_post_details_v3(self, post_id, skip=0, **kwargs):
         return self._send_request("GET", '/v3/posts/{}/details'.format(post_id),
-                                  params={'details': 'true', 'reply': skip}, **kwargs)
+                                  params={'details': 'true', 'reply': skip},
+                                  **self._model_kwargs(models.Post.from_details, kwargs))
 
     def upvote(self, post_id, **kwargs):
         return self._send_request("PUT", '/v2/posts/{}/upvote/'.format(post_id), **kwargs)
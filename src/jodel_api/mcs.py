@@ -0,0 +1,318 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+from future.utils import raise_from
+
+import errno
+import json
+import os
+import selectors
+import socket
+import ssl
+import struct
+import threading
+import time
+
+from jodel_api import gcmhack
+from jodel_api.gcmhack import GcmException
+from jodel_api.protos import mcs_pb2
+
+
+class _Connection:
+
+    def __init__(self, android_account, callback):
+        self.account, self.callback = android_account, callback
+        self.sock, self.state = None, "closed"
+        self.out, self.parser, self.counter = b"", None, 0
+        self.deadline, self.last_sent, self.reconnect_at, self.failures = 0.0, 0.0, 0.0, 0
+        self.verification, self.verified = None, threading.Event()
+
+
+class McsClient:
+    """ Keeps the MCS (GCM push) connections of many AndroidAccounts open in a single thread.
+
+    One selector loop does the TLS and login handshakes of all connections, sends a heartbeat on each of
+    them every heartbeat_interval seconds, answers the pings of the server and reconnects broken connections
+    with backoff. Use it as a context manager, or call start() and close(). add() opens the connection of an
+    AndroidAccount and wait_for_verification() waits for its verification push, from any thread. A callback
+    passed to add() is called in the loop thread with the account and every DataMessageStanza it receives, it
+    must not block (if it raises, the connection is opened again). """
+
+    host, port = gcmhack.MCS_HOST, gcmhack.MCS_PORT
+
+    def __init__(self, heartbeat_interval=60, connect_timeout=10, max_backoff=60, ssl_context=None):
+        self.heartbeat_interval, self.connect_timeout, self.max_backoff = \
+            heartbeat_interval, connect_timeout, max_backoff
+        self.ssl_context = ssl_context if ssl_context is not None else ssl.create_default_context()
+
+        self.selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._closing = []
+        self._lock = threading.Lock()
+        self._thread, self._running = None, False
+        self._addresses = None  # ((host, port), [(family, sockaddr), ...]) from getaddrinfo
+        self._resolver = None  # the thread that resolves host again
+
+        # wakes the loop up when connections are added or removed
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        """ Runs the loop in a background thread. """
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join()
+        for conn in list(self._connections.values()) + self._closing:
+            self._close(conn)
+        self._connections, self._closing = {}, []
+        self.selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def add(self, android_account, callback=None):
+        """ Opens the connection of android_account, unless it is open already. Returns True if it was added.
+        The first call resolves host (in the calling thread, the loop doesn't block on DNS lookups), it is resolved
+        again in the background whenever a connection has failed on all of its addresses. """
+        self._resolve()
+        with self._lock:
+            if id(android_account) in self._connections:
+                return False
+            self._connections[id(android_account)] = _Connection(android_account, callback)
+        self._wakeup()
+        return True
+
+    def remove(self, android_account):
+        with self._lock:
+            conn = self._connections.pop(id(android_account), None)
+            if conn is not None:
+                self._closing.append(conn)
+        self._wakeup()
+
+    def __len__(self):
+        return len(self._connections)
+
+    def wait_for_verification(self, android_account, timeout=30):
+        """ Waits for the verification push of android_account (which must have been added) and returns its
+        data, like AndroidAccount.receive_verification_from_gcm(). Raises a GcmException after timeout
+        seconds. """
+        conn = self._connections[id(android_account)]
+        if not conn.verified.wait(timeout):
+            raise GcmException("No verification_code received")
+
+        with self._lock:
+            data, conn.verification = conn.verification, None
+            conn.verified.clear()
+        try:
+            return json.loads(data)
+        except Exception as e:
+            raise_from(GcmException("No verification_code received"), None)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except socket.error:
+            pass  # the buffer is full, the loop will wake up anyway
+
+    def _run(self):
+        while self._running:
+            self.run_once()
+
+    def run_once(self, timeout=1.0):
+        """ Handles the events of all connections that are ready within timeout seconds, then sends heartbeats,
+        opens new connections and reopens broken ones. """
+        for key, events in self.selector.select(min(timeout, self._next_due() - time.time())):
+            if key.data is None:
+                try:
+                    while self._wakeup_r.recv(4096):
+                        pass
+                except socket.error:
+                    pass
+                continue
+
+            try:
+                self._handle_events(key.data, events)
+            except Exception:
+                self._fail(key.data)
+
+        with self._lock:
+            connections, closing, self._closing = list(self._connections.values()), self._closing, []
+        for conn in closing:
+            self._close(conn)
+
+        now = time.time()
+        for conn in connections:
+            try:
+                if conn.state == "closed" and conn.reconnect_at <= now:
+                    self._connect(conn)
+                elif conn.state in ("connecting", "handshake", "login") and conn.deadline < now:
+                    raise GcmException("Connecting timed out")
+                elif conn.state == "ready" and conn.last_sent + self.heartbeat_interval <= now:
+                    self._send(conn, gcmhack.encode_message(0, gcmhack.heartbeat(mcs_pb2.HeartbeatPing,
+                                                                                 conn.counter)))
+            except Exception:
+                self._fail(conn)
+
+    def _next_due(self):
+        """ Returns the time at which a heartbeat, reconnect or connect timeout is due next. """
+        with self._lock:
+            connections = list(self._connections.values())
+        due = [conn.reconnect_at if conn.state == "closed" else
+               conn.last_sent + self.heartbeat_interval if conn.state == "ready" else conn.deadline
+               for conn in connections]
+        return min(due) if due else float("inf")
+
+    def _resolve(self, force=False):
+        if force or self._addresses is None or self._addresses[0] != (self.host, self.port):
+            infos = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)
+            self._addresses = (self.host, self.port), [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+
+    def _resolve_again(self):
+        """ Resolves host again in a background thread (unless that is running already), the loop keeps using
+        the old addresses until the lookup succeeds. """
+        if self._resolver is not None and self._resolver.is_alive():
+            return
+
+        def resolve():
+            try:
+                self._resolve(force=True)
+            except socket.error:
+                pass  # the next round of failures tries again
+
+        self._resolver = threading.Thread(target=resolve)
+        self._resolver.daemon = True
+        self._resolver.start()
+
+    def _connect(self, conn):
+        # after a failure the next address is tried
+        addresses = self._addresses[1]
+        family, sockaddr = addresses[conn.failures % len(addresses)]
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex(sockaddr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise socket.error(err, os.strerror(err))
+
+        conn.sock, conn.state, conn.out = sock, "connecting", b""
+        conn.deadline = time.time() + self.connect_timeout
+        self.selector.register(sock, selectors.EVENT_WRITE, conn)
+
+    def _handle_events(self, conn, events):
+        if conn.state == "connecting":
+            err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, os.strerror(err))
+            # the plain socket is replaced by the ssl socket, so it is registered again
+            self.selector.unregister(conn.sock)
+            conn.sock = self.ssl_context.wrap_socket(conn.sock, server_hostname=self.host,
+                                                     do_handshake_on_connect=False)
+            conn.state = "handshake"
+            self.selector.register(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+
+        if conn.state == "handshake":
+            self._handshake(conn)
+            return
+
+        if events & selectors.EVENT_WRITE:
+            self._flush(conn)
+        if events & selectors.EVENT_READ:
+            self._read(conn)
+
+    def _handshake(self, conn):
+        try:
+            conn.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+            return
+        except ssl.SSLWantWriteError:
+            self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+            return
+
+        conn.state, conn.parser, conn.counter = "login", gcmhack.McsParser(), 0
+        login = gcmhack.login_request(conn.account.android_id, conn.account.security_token)
+        self._send(conn, struct.pack('B', gcmhack.MCS_VERSION) + gcmhack.encode_message(2, login))
+
+    def _send(self, conn, data):
+        conn.out += data
+        conn.last_sent = time.time()
+        self._flush(conn)
+
+    def _flush(self, conn):
+        while conn.out:
+            try:
+                sent = conn.sock.send(conn.out)
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+                break
+            conn.out = conn.out[sent:]
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.out else 0)
+        self.selector.modify(conn.sock, events, conn)
+
+    def _read(self, conn):
+        # read everything that is there, decrypted data left in the ssl socket wouldn't wake up the selector
+        chunks = []
+        while True:
+            try:
+                chunk = conn.sock.recv(2 ** 14)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+                break
+            if not chunk:
+                raise GcmException("socket closed by server")
+            chunks.append(chunk)
+
+        for tag, msg in conn.parser.feed(b"".join(chunks)):
+            self._dispatch(conn, tag, msg)
+
+    def _dispatch(self, conn, tag, msg):
+        conn.counter += 1
+
+        if tag == 0:
+            self._send(conn, gcmhack.encode_message(1, gcmhack.heartbeat(mcs_pb2.HeartbeatAck, conn.counter)))
+
+        elif tag == 3:
+            conn.state, conn.failures = "ready", 0
+
+        elif tag == 4:
+            raise GcmException("socket closed by server")
+
+        elif tag == 8:
+            dms = mcs_pb2.DataMessageStanza()
+            dms.ParseFromString(msg)
+
+            payload = gcmhack.get_verification_payload(dms)
+            if payload is not None:
+                with self._lock:
+                    conn.verification = payload  # the server sometimes sends a code twice, keep the last
+                    conn.verified.set()
+            if conn.callback is not None:
+                conn.callback(conn.account, dms)
+
+    def _close(self, conn):
+        if conn.sock is not None:
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+            conn.sock.close()
+        conn.sock, conn.state = None, "closed"
+
+    def _fail(self, conn):
+        self._close(conn)
+        conn.failures += 1
+        # once every address has failed, host may have moved to others
+        if conn.failures % len(self._addresses[1]) == 0:
+            self._resolve_again()
+        conn.reconnect_at = time.time() + min(self.max_backoff, 2 ** (conn.failures - 1))
@@ -0,0 +1,152 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import tempfile
+import threading
+
+from jodel_api import models
+from jodel_api.cache import SingleFlight
+from jodel_api.jodel_api import create_session
+
+
+def get_image_urls(data, thumbnails=False):
+    """ Returns the image urls (or thumbnail urls) of all image posts in data, which is a (status_code,
+    response) tuple, a response of a get_posts_* or get_pictures_* method, a FeedPage or a list of posts. """
+    if isinstance(data, tuple):
+        data = data[1] if data[0] == 200 else {}
+    posts = data if isinstance(data, list) else models.get_posts(data)
+    key = 'thumbnail_url' if thumbnails else 'image_url'
+    return [post.get(key) for post in posts if post.get(key)]
+
+
+class MediaFetcher:
+    """ Downloads images concurrently into a content-addressed cache in cache_dir.
+
+    Every image is stored once under the sha256 of its content, no matter how many urls point to it, and each
+    url is mapped to the hash of the content it returned. Urls that are already cached are not downloaded
+    again. Concurrent fetches of the same url wait for a single download. When the images take up more than
+    max_size bytes, the least recently used ones are deleted. session defaults to a pooled requests.Session
+    with max_workers connections (see create_session()). A MediaFetcher can be shared between threads, but
+    not between processes. """
+
+    chunk_size = 2 ** 16
+
+    def __init__(self, cache_dir, max_size=2 ** 30, max_workers=8, session=None, timeout=30):
+        self.cache_dir, self.max_size, self.max_workers, self.timeout = cache_dir, max_size, max_workers, timeout
+        self.session = session if session is not None else create_session(pool_maxsize=max_workers)
+        self._in_flight = SingleFlight()
+        self._lock = threading.Lock()
+
+        for subdir in ("objects", "urls", "tmp"):
+            path = os.path.join(cache_dir, subdir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        # digest -> size of all cached images, least recently used first
+        objects = []
+        for name in os.listdir(os.path.join(cache_dir, "objects")):
+            stat = os.stat(os.path.join(cache_dir, "objects", name))
+            objects.append((stat.st_mtime, name, stat.st_size))
+        self._objects = OrderedDict((name, size) for _, name, size in sorted(objects))
+        self.size = sum(self._objects.values())
+
+    def fetch(self, url):
+        """ Returns the path of the cached image of url, downloading it if needed. Raises an Exception if the
+        download fails. """
+        url = "https:" + url if url.startswith("//") else url
+        path = self._get_cached(url)
+        if path is not None:
+            return path
+        return self._in_flight.do(url, lambda: self._get_cached(url) or self._download(url))
+
+    def fetch_all(self, urls):
+        """ Fetches urls concurrently and returns their paths in order, a url that failed returns the
+        exception instead. """
+        def run(url):
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run, urls))
+
+    def _url_path(self, url):
+        return os.path.join(self.cache_dir, "urls", hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest)
+
+    def _get_cached(self, url):
+        try:
+            with open(self._url_path(url)) as f:
+                digest = f.read().strip()
+        except (IOError, OSError):
+            return None
+
+        with self._lock:
+            if digest not in self._objects:
+                return None
+            self._objects[digest] = self._objects.pop(digest)  # mark as recently used
+        path = self._object_path(digest)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None  # evicted in the meantime
+        return path
+
+    def _download(self, url):
+        resp = self.session.get(url, stream=True, timeout=self.timeout)
+        try:
+            if resp.status_code != 200:
+                raise Exception("Error downloading image: " + str((resp.status_code, url)))
+
+            # stream into a temporary file, hashing along the way
+            digest, size = hashlib.sha256(), 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, "tmp"))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in resp.iter_content(self.chunk_size):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+                digest = digest.hexdigest()
+                self._store(digest, size, tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        finally:
+            resp.close()
+
+        self._write_atomic(self._url_path(url), digest)
+        return self._object_path(digest)
+
+    def _store(self, digest, size, tmp_path):
+        with self._lock:
+            if digest in self._objects:
+                self._objects[digest] = self._objects.pop(digest)
+                return
+            os.rename(tmp_path, self._object_path(digest))
+            self._objects[digest] = size
+            self.size += size
+            while self.size > self.max_size and len(self._objects) > 1:
+                old_digest, old_size = self._objects.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(self._object_path(old_digest))
+                except OSError:
+                    pass
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, "tmp"))
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # os.rename doesn't replace existing files on Windows
+            os.remove(path)
+            os.rename(tmp_path, path)
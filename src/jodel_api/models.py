@@ -0,0 +1,168 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+# Compact result objects for the get_posts_*, get_post_details* and post_search methods (pass typed=True).
+# The frequently used fields are slots. All other fields are kept as a tuple of values plus a tuple of keys
+# that is shared by all objects with the same fields, which is much smaller than a dict per object. Replies
+# and image metadata are only turned into objects when they are accessed.
+
+_shared = {}
+
+
+def _share(value):
+    """ Returns one shared instance per distinct value, eg. channel names or the key tuples of _pack(). """
+    return _shared.setdefault(value, value) if value is not None else None
+
+
+def _pack(data, skip):
+    keys = tuple(key for key in data if key not in skip)
+    return (_share(keys), tuple(data[key] for key in keys)) if keys else None
+
+
+def _unpack(extra):
+    return dict(zip(*extra)) if extra else {}
+
+
+def _get_packed(extra, key, default=None):
+    if extra and key in extra[0]:
+        return extra[1][extra[0].index(key)]
+    return default
+
+
+def get_post_id(post):
+    """ Returns the post_id of a post dict or Post object. """
+    return post.post_id if isinstance(post, Post) else post.get('post_id')
+
+
+def get_posts(resp):
+    """ Returns the list of posts of a FeedPage or a response dict of a get_posts_* method. """
+    return list(resp) if isinstance(resp, FeedPage) else resp.get('posts') or []
+
+
+class Location(object):
+    __slots__ = ('name', 'lat', 'lng')
+
+    def __init__(self, name, lat, lng):
+        self.name, self.lat, self.lng = name, lat, lng
+
+    @classmethod
+    def from_dict(cls, data):
+        if not data:
+            return None
+        coordinates = data.get('loc_coordinates') or {}
+        return cls(_share(data.get('name')), coordinates.get('lat'), coordinates.get('lng'))
+
+    def to_dict(self):
+        return {'name': self.name, 'loc_coordinates': {'lat': self.lat, 'lng': self.lng}}
+
+    def __repr__(self):
+        return "Location({!r}, {!r}, {!r})".format(self.name, self.lat, self.lng)
+
+
+class Image(object):
+    __slots__ = ('url', 'thumbnail_url', 'headers', 'approved')
+
+    def __init__(self, url, thumbnail_url=None, headers=None, approved=None):
+        self.url, self.thumbnail_url, self.headers, self.approved = url, thumbnail_url, headers, approved
+
+    def __repr__(self):
+        return "Image({!r})".format(self.url)
+
+
+class Post(object):
+    """ A post. Attributes hold the hot fields (None if the API didn't send them), all other fields of the
+    response are available through get(). to_dict() rebuilds the response dict, except that locations only
+    keep their name and coordinates. """
+
+    __slots__ = ('post_id', 'message', 'created_at', 'vote_count', 'child_count', 'color', 'channel',
+                 'location', '_replies', '_extra')
+    _fields = ('post_id', 'message', 'created_at', 'vote_count', 'child_count', 'color')
+    _image_fields = ('image_url', 'thumbnail_url', 'image_headers', 'image_approved')
+    _replies_key = 'children'
+
+    def __init__(self, data):
+        for field in self._fields:
+            setattr(self, field, data.get(field))
+        self.color = _share(self.color)
+        self.channel = _share(data.get('channel'))
+        self.location = Location.from_dict(data.get('location'))
+        self._replies = data.get(self._replies_key)
+
+        self._extra = _pack(data, self._fields + ('channel', 'location', self._replies_key))
+
+    def get(self, key, default=None):
+        if key in self._fields or key in ('channel', 'location'):
+            value = getattr(self, key)
+            return value if value is not None else default
+        return _get_packed(self._extra, key, default)
+
+    @property
+    def replies(self):
+        """ The replies that came with this post (only post details contain replies). """
+        if self._replies and isinstance(self._replies[0], dict):
+            self._replies = [Reply(reply) for reply in self._replies]
+        return self._replies or []
+
+    @property
+    def image(self):
+        """ An Image if this is an image post, otherwise None. """
+        if _get_packed(self._extra, 'image_url') is None:
+            return None
+        return Image(*[_get_packed(self._extra, field) for field in self._image_fields])
+
+    def to_dict(self):
+        data = _unpack(self._extra)
+        data.update((field, getattr(self, field)) for field in self._fields + ('channel',)
+                    if getattr(self, field) is not None)
+        if self.location is not None:
+            data['location'] = self.location.to_dict()
+        if self._replies is not None:
+            data[self._replies_key] = [reply.to_dict() if isinstance(reply, Post) else reply
+                                       for reply in self._replies]
+        return data
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.post_id)
+
+    @classmethod
+    def from_details(cls, data):
+        """ Creates a Post from a get_post_details_v3 response, its replies come from 'replies', the paging
+        fields ('next', 'remaining', ...) are available through get(). """
+        details = dict(data.get('details') or {})
+        details[cls._replies_key] = data.get('replies')
+        details.update((key, value) for key, value in data.items() if key not in ('details', 'replies'))
+        return cls(details)
+
+
+class Reply(Post):
+    __slots__ = ()
+
+
+class FeedPage(object):
+    """ A page of posts as returned by the get_posts_* methods and post_search. Iterating over it yields the
+    posts, all other fields of the response are available through get(). """
+
+    __slots__ = ('posts', '_extra')
+
+    def __init__(self, data):
+        self.posts = [Post(post) for post in data.get('posts') or []]
+        self._extra = _pack(data, ('posts',))
+
+    def get(self, key, default=None):
+        return _get_packed(self._extra, key, default)
+
+    def __iter__(self):
+        return iter(self.posts)
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __getitem__(self, index):
+        return self.posts[index]
+
+    def to_dict(self):
+        data = _unpack(self._extra)
+        data['posts'] = [post.to_dict() for post in self.posts]
+        return data
+
+    def __repr__(self):
+        return "FeedPage(<{} posts>)".format(len(self.posts))
@@ -0,0 +1,55 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+from jodel_api.jodel_api import JodelAccount
+
+# the number of accounts that may be in each stage at once
+default_limits = {"account": 8,            # refresh_all_tokens(), creates the Jodel account
+                  "checkin": 8,            # GCM checkin of a new AndroidAccount
+                  "push_token": 8,         # registering the push token with GCM
+                  "send_push_token": 8,    # send_push_token()
+                  "verify": 32}            # waiting for the push and verify_push()
+
+
+def create_verified_accounts(n, lat, lng, city, limits=None, verification_timeout=60, attempts=3, mcs_client=None,
+                             **kwargs):
+    """ Creates n new accounts at lat, lng, city and verifies them, running the stages of different accounts
+    at the same time.
+
+    Each account goes through the stages of default_limits, limits maps stages to the number of accounts
+    that may be in that stage at once (the others wait for a free slot). Like verify(), every stage runs as
+    soon as the previous one is done, the stages after the checkin must finish within verification_timeout
+    seconds, and sending the push token and waiting for the push is tried up to `attempts` times. With an
+    McsClient as mcs_client all pushes are received in its single thread, instead of over a socket per
+    account. kwargs are passed to the JodelAccount constructor, eg. a shared session or an account_store to
+    save the accounts.
+
+    Yields (account, result) in the order the accounts are done. result is the (status_code, response) of
+    verify_push() (200 if the account is verified), of send_push_token() if that failed, or the exception that
+    was raised. account is None if it couldn't be created. """
+    limits = dict(default_limits, **(limits or {}))
+    stages = {stage: threading.BoundedSemaphore(limit) for stage, limit in limits.items()}
+
+    def run():
+        account = None
+        try:
+            with stages["account"]:
+                account = JodelAccount(lat, lng, city, **kwargs)
+            return account, account.verify(verification_timeout=verification_timeout, mcs_client=mcs_client,
+                                           attempts=attempts, stages=stages)
+        except Exception as e:
+            return account, e
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(n, sum(limits.values()))))
+    futures = []
+    try:
+        futures = [executor.submit(run) for _ in range(n)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
@@ -0,0 +1,73 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from collections import OrderedDict
+
+from jodel_api import models
+
+
+class FeedPoller:
+    """ Polls the recent posts of the account's location, a channel or a hashtag and returns only the posts
+    it hasn't returned before.
+
+    The first poll() reads one page of `limit` posts (with skip_existing=True it only remembers them and
+    returns nothing). Later polls read pages of `poll_limit` posts and stop at the first post that has
+    already been seen, following the `after` cursor for at most max_pages pages if everything is new. The
+    ids of the last max_seen returned posts are remembered. Additional kwargs (eg. typed=True) are passed
+    to get_posts_recent(). A FeedPoller must not be polled from several threads at once. """
+
+    def __init__(self, account, channel=None, hashtag=None, limit=60, poll_limit=10, max_pages=6,
+                 max_seen=10000, skip_existing=False, **kwargs):
+        self.account = account
+        self.channel, self.hashtag = channel, hashtag
+        self.limit, self.poll_limit, self.max_pages = limit, poll_limit, max_pages
+        self.max_seen = max_seen
+        self.skip_existing = skip_existing
+        self.kwargs = kwargs
+
+        self._seen = OrderedDict()
+        self._first_poll = True
+
+    def poll(self):
+        """ Returns the new posts since the last poll, newest first. Raises an Exception if a page can't be
+        loaded. """
+        limit = self.limit if self._first_poll else self.poll_limit
+        max_pages = 1 if self._first_poll else self.max_pages
+        new_posts, new_ids, after = [], set(), None
+
+        for _ in range(max_pages):
+            status, resp = self.account.get_posts_recent(limit=limit, after=after, channel=self.channel,
+                                                         hashtag=self.hashtag, **self.kwargs)
+            if status != 200:
+                raise Exception("Error polling posts: " + str((status, resp)))
+
+            posts = models.get_posts(resp)
+            for post in posts:
+                post_id = models.get_post_id(post)
+                if post_id in new_ids or self._is_seen(post_id):
+                    break
+                new_posts.append(post)
+                new_ids.add(post_id)
+            else:
+                if posts:
+                    after = models.get_post_id(posts[-1])
+                    continue
+            break
+
+        # remember the oldest post first, so the newest are evicted last
+        for post in reversed(new_posts):
+            self._add_seen(models.get_post_id(post))
+
+        skip = self._first_poll and self.skip_existing
+        self._first_poll = False
+        return [] if skip else new_posts
+
+    def _is_seen(self, post_id):
+        if post_id not in self._seen:
+            return False
+        self._seen[post_id] = self._seen.pop(post_id)  # mark as recently used
+        return True
+
+    def _add_seen(self, post_id):
+        self._seen[post_id] = None
+        while len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
@@ -0,0 +1,117 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import threading
+import time
+
+from jodel_api.jodel_api import JodelAccount
+
+
+class _AccountStats:
+
+    def __init__(self):
+        self.load, self.calls, self.errors, self.consecutive_errors = 0, 0, 0, 0
+        self.last_acquired, self.quarantined_until = 0.0, 0.0
+
+
+class AccountPool:
+    """ Hands out the accounts of a pool, skipping accounts that keep failing.
+
+    With strategy="round_robin" the accounts take turns, with strategy="least_loaded" the account with the
+    fewest calls in progress is chosen. Calls that raise or return one of error_statuses count as errors. An
+    account with max_errors errors in a row is taken out of rotation for `quarantine` seconds, after which it
+    gets another chance: a successful call brings it back for good, another error quarantines it again.
+
+    Use call() to run a method on the next account, or acquire() and release() to use an account directly (eg.
+    an AsyncJodelAccount). Iterating a pool yields all accounts, so it can be passed to sweep_locations(). """
+
+    error_statuses = (401, 403, 429, 500, 502, 503, 504)
+
+    def __init__(self, accounts, strategy="round_robin", max_errors=3, quarantine=300):
+        if strategy not in ("round_robin", "least_loaded"):
+            raise ValueError("strategy must be either round_robin or least_loaded.")
+
+        self.accounts = list(accounts)
+        self.strategy, self.max_errors, self.quarantine = strategy, max_errors, quarantine
+        self._stats = {id(account): _AccountStats() for account in self.accounts}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_account_data(cls, account_data, lat, lng, city, account_class=JodelAccount, update_location=False,
+                          strategy="round_robin", max_errors=3, quarantine=300, **kwargs):
+        """ Creates a pool from a list of get_account_data() dicts. The accounts are created at lat, lng, city
+        (without updating their location unless update_location=True), kwargs are passed to every
+        constructor, eg. a shared session or rate_limiter. """
+        accounts = [account_class(lat, lng, city, update_location=update_location, **dict(kwargs, **data))
+                    for data in account_data]
+        return cls(accounts, strategy=strategy, max_errors=max_errors, quarantine=quarantine)
+
+    def __iter__(self):
+        return iter(self.accounts)
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def acquire(self):
+        """ Returns the next healthy account, which must be handed back with release(). Raises an Exception if
+        all accounts are quarantined. """
+        with self._lock:
+            now = time.time()
+            healthy = [i for i, account in enumerate(self.accounts)
+                       if self._stats[id(account)].quarantined_until <= now]
+            if not healthy:
+                raise Exception("Error acquiring account: all {} accounts are quarantined.".format(len(self)))
+
+            if self.strategy == "round_robin":
+                i = min(healthy, key=lambda i: (i - self._next) % len(self.accounts))
+                self._next = i + 1
+            else:
+                i = min(healthy, key=lambda i: (self._stats[id(self.accounts[i])].load,
+                                                self._stats[id(self.accounts[i])].last_acquired))
+
+            stats = self._stats[id(self.accounts[i])]
+            stats.load += 1
+            stats.last_acquired = now
+            return self.accounts[i]
+
+    def release(self, account, result=None):
+        """ Hands back an account, result is the (status_code, response) of its call or the exception it
+        raised. """
+        error = isinstance(result, Exception) or (isinstance(result, tuple) and result[0] in self.error_statuses)
+        with self._lock:
+            stats = self._stats[id(account)]
+            stats.load -= 1
+            stats.calls += 1
+            if not error:
+                stats.consecutive_errors = 0
+                return
+
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            if stats.consecutive_errors >= self.max_errors:
+                stats.quarantined_until = time.time() + self.quarantine
+
+    def call(self, name, *args, **kwargs):
+        """ Runs the API method `name` on the next account and returns its result. """
+        account = self.acquire()
+        try:
+            result = getattr(account, name)(*args, **kwargs)
+        except Exception as e:
+            self.release(account, e)
+            raise
+        self.release(account, result)
+        return result
+
+    def stats(self):
+        """ Returns a dict per account with its device_uid, the number of calls in progress (load), calls,
+        errors, error_rate and whether it is quarantined. """
+        result = []
+        with self._lock:
+            now = time.time()
+            for account in self.accounts:
+                stats = self._stats[id(account)]
+                result.append({"device_uid": account.device_uid, "load": stats.load, "calls": stats.calls,
+                               "errors": stats.errors,
+                               "error_rate": stats.errors / float(stats.calls) if stats.calls else 0.0,
+                               "quarantined": stats.quarantined_until > now})
+        return result
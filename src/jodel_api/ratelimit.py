@@ -0,0 +1,75 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import threading
+import time
+
+global_rate_limiter = None
+
+
+class TokenBucket:
+    """ Token bucket that refills `rate` tokens per second up to `capacity` (the burst size, defaults to rate,
+    but at least 1). A call that finds the bucket empty reserves its token anyway and waits until it has been
+    refilled, so waiting callers are served in order and never spin. """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """ Takes tokens from the bucket and returns the number of seconds to wait before they may be used. """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class RateLimiter:
+    """ Paces the calls of the accounts it is passed to. Calls go through the `read` bucket (GET requests and
+    read_endpoints) or the `write` bucket (everything else, eg. votes and posts), and additionally through the
+    `total` bucket. Any of the buckets may be None. Override is_read() to classify calls differently. """
+
+    # endpoints that read data, although they aren't called with GET
+    read_endpoints = frozenset(["/v3/posts/search", "/v3/user/notifications"])
+
+    def __init__(self, read=None, write=None, total=None):
+        self.read, self.write, self.total = read, write, total
+
+    def is_read(self, method, endpoint):
+        """ Returns True if the call goes through the read bucket, False for the write bucket. """
+        return method == "GET" or endpoint.rstrip("/") in self.read_endpoints
+
+    def reserve(self, method, endpoint):
+        """ Reserves a token in every bucket the call goes through and returns the longest wait. """
+        buckets = (self.read if self.is_read(method, endpoint) else self.write, self.total)
+        return max([bucket.reserve() for bucket in buckets if bucket is not None] or [0.0])
+
+    def acquire(self, method, endpoint):
+        delay = self.reserve(method, endpoint)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+def set_global_rate_limiter(rate_limiter):
+    """ Sets a RateLimiter that applies to all accounts of this process (on top of their own limiters), pass
+    None to remove it. """
+    global global_rate_limiter
+    global_rate_limiter = rate_limiter
+
+
+def reserve(rate_limiter, method, endpoint):
+    """ Reserves a token from rate_limiter (may be None) and the global rate limiter, returns the longest wait. """
+    delays = [limiter.reserve(method, endpoint) for limiter in (rate_limiter, global_rate_limiter)
+              if limiter is not None]
+    return max(delays) if delays else 0.0
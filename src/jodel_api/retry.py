@@ -0,0 +1,94 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+from email.utils import parsedate_tz, mktime_tz
+from future.utils import string_types
+import random
+import threading
+import time
+
+
+class RetryBudget:
+    """ Caps retries to a fraction of all calls, shared by every RetryPolicy (and thereby every account) it is
+    passed to. Each call deposits `ratio` tokens, each retry withdraws one. `reserve` tokens are available up
+    front so single failures are always retried, at most `max_tokens` can be saved up. When the budget is
+    exhausted, failing calls return (or raise) immediately instead of turning an outage into a retry storm. """
+
+    def __init__(self, ratio=0.2, reserve=10, max_tokens=100):
+        self.ratio, self.max_tokens = ratio, max_tokens
+        self.tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def parse_retry_after(value):
+    """ Returns the delay in seconds of a Retry-After header (delta-seconds or HTTP-date), None if invalid. """
+    if not isinstance(value, string_types):
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    date = parsedate_tz(value)
+    return max(0.0, mktime_tz(date) - time.time()) if date else None
+
+
+class RetryPolicy:
+    """ Decides which failed calls are retried and how long to wait in between.
+
+    max_attempts is the total number of tries per call. A call is retried if its status code is in `statuses`
+    or if it raised one of `exceptions`, and only for the HTTP methods in `methods` (None means all methods).
+    The n-th retry waits backoff_factor * 2 ** (n - 1) seconds, capped at backoff_max. With jitter=True the
+    wait is drawn uniformly from [0, backoff] so clients that failed together don't retry together. A
+    Retry-After header sent by the server takes precedence if respect_retry_after is set. An optional
+    RetryBudget limits the retries across all calls that share it.
+
+    The defaults retry error 502 twice without waiting, which is what JodelAccount always did. """
+
+    def __init__(self, max_attempts=3, statuses=(502,), exceptions=(), methods=None, backoff_factor=0,
+                 backoff_max=30, jitter=True, respect_retry_after=True, budget=None):
+        self.max_attempts = max_attempts
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.methods = frozenset(methods) if methods is not None else None
+        self.backoff_factor, self.backoff_max = backoff_factor, backoff_max
+        self.jitter, self.respect_retry_after = jitter, respect_retry_after
+        self.budget = budget
+
+    def record_call(self):
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def is_retry(self, method, attempt, status=None, exception=None):
+        """ Returns True if the call should be sent again after its attempt-th try failed with status or
+        exception. """
+        if attempt >= self.max_attempts or (self.methods is not None and method not in self.methods):
+            return False
+
+        if exception is not None:
+            retry = isinstance(exception, self.exceptions)
+        else:
+            retry = status in self.statuses
+
+        return retry and (self.budget is None or self.budget.withdraw())
+
+    def get_backoff(self, attempt, retry_after=None):
+        """ Returns the time in seconds to wait before the try after the attempt-th one. """
+        if self.respect_retry_after and retry_after is not None:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return min(delay, self.backoff_max)
+
+        delay = min(self.backoff_max, self.backoff_factor * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
@@ -0,0 +1,200 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import datetime
+import json
+import re
+import sqlite3
+import threading
+
+from jodel_api import models
+from jodel_api.jodel_api import JodelAccount
+
+_hashtag_re = re.compile(r"#(\w+)", re.UNICODE)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS posts (
+    post_id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    channel TEXT,
+    created_at TEXT,
+    vote_count INTEGER,
+    child_count INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_channel_created_at ON posts (channel, created_at);
+CREATE INDEX IF NOT EXISTS posts_parent_id_created_at ON posts (parent_id, created_at);
+CREATE INDEX IF NOT EXISTS posts_created_at ON posts (created_at);
+CREATE TABLE IF NOT EXISTS post_hashtags (
+    hashtag TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    PRIMARY KEY (hashtag, post_id)
+);
+CREATE INDEX IF NOT EXISTS post_hashtags_post_id ON post_hashtags (post_id);
+"""
+
+# parent_id and channel are kept if a post is stored again from a response that doesn't contain them
+# (eg. a reply that shows up in a feed)
+_upsert_post = """
+INSERT OR REPLACE INTO posts (post_id, parent_id, channel, created_at, vote_count, child_count, data)
+VALUES (?, COALESCE(?, (SELECT parent_id FROM posts WHERE post_id = ?)),
+        COALESCE(?, (SELECT channel FROM posts WHERE post_id = ?)), ?, ?, ?, ?)
+"""
+
+
+def _timestamp(value):
+    """ Formats a datetime like the API's created_at, strings are passed through. """
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(value.microsecond // 1000)
+    return value
+
+
+class PostStore:
+    """ Stores posts in an SQLite database (path, or ":memory:").
+
+    upsert() takes the responses of get_posts_*, post_search and get_post_details(_v3) and writes all of
+    their posts (including replies) in a single transaction. Posts are indexed by post_id, channel,
+    hashtag (parsed from the message), created_at and parent. The query methods return the post dicts,
+    newest first (replies oldest first). A PostStore can be shared between threads. """
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(_schema)
+
+    def close(self):
+        self.conn.close()
+
+    def upsert(self, data, channel=None):
+        """ Inserts or updates all posts in data, which is an API response (a (status_code, response) tuple
+        or just the response), a FeedPage or Post, or a list of post dicts. channel is stored for posts that
+        don't name their channel, eg. those from get_posts_recent(channel=...). Returns the number of posts
+        written. """
+        rows, hashtags = [], []
+        for post, parent_id in self._get_posts(data):
+            post_id = post.get('post_id')
+            if not post_id:
+                continue
+            post_channel = post.get('channel') or channel
+            rows.append((post_id, parent_id, post_id, post_channel, post_id, post.get('created_at'),
+                         post.get('vote_count'), post.get('child_count'), json.dumps(post)))
+            hashtags.extend((tag.lower(), post_id) for tag in _hashtag_re.findall(post.get('message') or ""))
+
+        with self._lock, self.conn:
+            self.conn.executemany(_upsert_post, rows)
+            self.conn.executemany("INSERT OR IGNORE INTO post_hashtags (hashtag, post_id) VALUES (?, ?)", hashtags)
+        return len(rows)
+
+    @staticmethod
+    def _get_posts(data):
+        """ Yields (post dict, parent_id) for all posts and replies in data. """
+        if isinstance(data, tuple):
+            if data[0] != 200:
+                return
+            data = data[1]
+        if isinstance(data, (models.Post, models.FeedPage)):
+            data = data.to_dict()
+
+        if isinstance(data, list):
+            posts = data
+        elif 'details' in data:
+            posts = [dict(data['details'], children=data.get('replies') or [])]
+        elif 'posts' in data:
+            posts = data['posts']
+        else:
+            posts = [data]
+
+        for post in posts:
+            children = post.get('children')
+            if children is not None:
+                post = dict(post)
+                del post['children']
+            yield post, post.get('parent_id')
+            for child in children or []:
+                yield child, child.get('parent_id') or post.get('post_id')
+
+    def _query(self, where, args, order="DESC", limit=None):
+        sql = "SELECT data FROM posts WHERE {} ORDER BY created_at {}".format(where, order)
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+        with self._lock:
+            return [json.loads(row[0]) for row in self.conn.execute(sql, args)]
+
+    def get(self, post_id):
+        posts = self._query("post_id = ?", (post_id,))
+        return posts[0] if posts else None
+
+    def posts_in_channel(self, channel, since=None, limit=None):
+        """ Returns the posts (without replies) of channel, created at or after since (a datetime or a
+        timestamp string like created_at). """
+        return self._query("channel = ? AND created_at >= ? AND parent_id IS NULL",
+                           (channel, _timestamp(since) or ""), limit=limit)
+
+    def posts_with_hashtag(self, hashtag, since=None, limit=None):
+        return self._query("post_id IN (SELECT post_id FROM post_hashtags WHERE hashtag = ?) AND created_at >= ?",
+                           (hashtag.lstrip("#").lower(), _timestamp(since) or ""), limit=limit)
+
+    def posts_since(self, since, limit=None):
+        return self._query("created_at >= ? AND parent_id IS NULL", (_timestamp(since),), limit=limit)
+
+    def replies_of(self, post_id):
+        return self._query("parent_id = ?", (post_id,), order="ASC")
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+
+class AccountStore:
+    """ Stores the get_account_data() of accounts in an SQLite database (path, or ":memory:").
+
+    Accounts created by load(), or passed as account_store to the JodelAccount constructor, are saved whenever
+    their tokens change (refresh_all_tokens(), refresh_access_token() and the automatic refresh), each save is
+    a single transaction. Loaded accounts make no calls until they are used, their access token is refreshed
+    on first use if it has expired in the meantime. An AccountStore can be shared between threads. """
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS accounts (device_uid TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def close(self):
+        self.conn.close()
+
+    def save(self, account):
+        """ Saves the account data of account (a JodelAccount or a get_account_data() dict). """
+        data = account if isinstance(account, dict) else account.get_account_data()
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO accounts (device_uid, data) VALUES (?, ?)",
+                              (data['device_uid'], json.dumps(data)))
+
+    def get(self, device_uid):
+        """ Returns the account data of device_uid, or None. """
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM accounts WHERE device_uid = ?", (device_uid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        with self._lock:
+            return [json.loads(row[0]) for row in self.conn.execute("SELECT data FROM accounts ORDER BY rowid")]
+
+    def delete(self, device_uid):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM accounts WHERE device_uid = ?", (device_uid,))
+
+    def load(self, lat, lng, city, account_class=JodelAccount, **kwargs):
+        """ Creates an account (of account_class) at lat, lng, city for every stored account, without any remote
+        calls (a record that misses a token gets a new one on first use). kwargs are passed to every constructor,
+        eg. a shared session. """
+        return [account_class(lat, lng, city, update_location=False, lazy=True, account_store=self,
+                              **dict(kwargs, **data))
+                for data in self.all()]
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
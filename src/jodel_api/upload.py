@@ -0,0 +1,162 @@
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import base64
+import io
+import os
+import uuid
+
+from future.utils import text_type
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# a multiple of 3, so the base64 encoded chunks can simply be concatenated
+CHUNK_SIZE = 3 * 2 ** 14
+
+
+class ImagePayload:
+    """ Payload of create_post() with an image that is base64 encoded while the request is sent, instead of
+    being held in memory (several times) as part of the payload. image is a file path (unicode on Python 2),
+    bytes, a memoryview or a binary file object (read from its current position). """
+
+    def __init__(self, payload, image):
+        self.payload, self.image = payload, image
+
+    def encode(self, codec):
+        """ Returns the body of the request as an ImageBody. """
+        # encode the payload around a placeholder, the image is inserted between both halves
+        placeholder = uuid.uuid4().hex
+        data = codec.encode(dict(self.payload, image=placeholder))
+        prefix, suffix = data.split(placeholder.encode("ascii"))
+        return ImageBody(prefix, self.image, suffix)
+
+
+class ImageBody:
+    """ Request body that yields its json prefix, the base64 encoded image in chunks and the json suffix. It can
+    be iterated any number of times (for signing and for every retry) and has a length, so it is sent with a
+    Content-Length header instead of chunked. reader() returns a file-like object to send it with requests. """
+
+    def __init__(self, prefix, image, suffix):
+        self.prefix, self.suffix = prefix, suffix
+        if isinstance(image, text_type):
+            self.image, self.size = image, os.path.getsize(image)
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            self.image = memoryview(image)
+            if self.image.itemsize != 1:
+                self.image = self.image.cast("B")  # count and slice bytes, not items
+            self.size = len(self.image)
+        elif getattr(image, "seekable", lambda: True)():  # Python 2 files have no seekable()
+            self.image, self.start = image, image.tell()
+            image.seek(0, io.SEEK_END)
+            self.size = image.tell() - self.start
+        else:
+            # can't be rewound for a second pass
+            self.image = memoryview(image.read())
+            self.size = len(self.image)
+
+    def __len__(self):
+        return int(len(self.prefix) + (self.size + 2) // 3 * 4 + len(self.suffix))  # a long on Python 2
+
+    def __iter__(self):
+        yield self.prefix
+        for chunk in self._iter_image():
+            yield base64.b64encode(chunk)
+        yield self.suffix
+
+    def reader(self):
+        """ Returns a new file-like object that reads the body from the start. """
+        return ImageReader(self)
+
+    def _iter_image(self):
+        if isinstance(self.image, memoryview):
+            for i in range(0, self.size, CHUNK_SIZE):
+                yield self.image[i:i + CHUNK_SIZE]
+            return
+
+        if isinstance(self.image, text_type):
+            with open(self.image, "rb") as f:
+                for chunk in iter(lambda: _read(f, CHUNK_SIZE), b""):
+                    yield chunk
+            return
+
+        self.image.seek(self.start)
+        remaining = self.size
+        while remaining > 0:
+            size = min(CHUNK_SIZE, remaining)
+            chunk = _read(self.image, size)
+            if len(chunk) < size:
+                raise IOError("The image file was truncated while it was sent.")
+            remaining -= size
+            yield chunk
+
+
+class ImageReader:
+    """ File-like view of an ImageBody. http.client (and httplib on Python 2) send objects with read() in
+    blocks, but can't send iterables with a Content-Length. """
+
+    def __init__(self, body):
+        self._chunks, self._buffer, self._size = iter(body), b"", len(body)
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        size = len(self._buffer) if size < 0 else size
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _read(f, size):
+    """ Reads size bytes from f, fewer only at the end of the file. Unbuffered files may return fewer bytes
+    from a single read(), but every chunk except the last must be a multiple of 3 to be base64 encoded on its
+    own. """
+    chunks = []
+    while size > 0:
+        chunk = f.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def shrink_image(image, max_size, quality=85):
+    """ Returns image (see ImagePayload) unchanged if it is at most max_size bytes, otherwise it is scaled down
+    and recompressed as JPEG until it fits, and returned as bytes. Requires Pillow. """
+    if Image is None:
+        raise ImportError("Shrinking images requires Pillow, install it with `pip install Pillow`.")
+
+    data = image
+    if isinstance(image, text_type):
+        size = os.path.getsize(image)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        size = memoryview(image).nbytes
+        data = io.BytesIO(image)
+    else:
+        start = image.tell()
+        image.seek(0, io.SEEK_END)
+        size = image.tell() - start
+        image.seek(start)
+    if size <= max_size:
+        return image
+
+    img = Image.open(data)
+    img.load()
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    scale = min(1.0, (float(max_size) / size) ** 0.5)
+    while True:
+        resized = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        out = io.BytesIO()
+        resized.save(out, format="JPEG", quality=quality, optimize=True)
+        if out.tell() <= max_size or resized.width == 1:
+            return out.getvalue()
+        scale *= 0.8
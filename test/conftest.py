@@ -0,0 +1,6 @@
+import sys
+
+# async def doesn't compile before 3.5, and the async tests use asyncio.run()
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append("test_aio.py")
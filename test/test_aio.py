@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+import jodel_api
+from mock import MagicMock, patch
+import asyncio
+import pickle
+
+lat, lng, city = 49.021785, 12.103129, "Regensburg"
+test_channel = "WasGehtHeute?"
+
+offline_account = {'access_token': 'token', 'device_uid': 'a' * 64, 'refresh_token': 'refresh',
+                   'distinct_id': 'distinct', 'expiration_date': 4102444800, 'is_legacy': False}
+
+
+class FakeAsyncResponse:
+
+    def __init__(self, status, content, headers=None):
+        self.status, self.content, self.headers = status, content, headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def read(self):
+        return self.content
+
+
+class TestAsyncAccount:
+
+    def setup_method(self, method):
+        self.session = MagicMock()
+        self.j = jodel_api.AsyncJodelAccount(lat, lng, city, session=self.session, **offline_account)
+
+    def test_json_response(self):
+        self.session.request.return_value = FakeAsyncResponse(200, b'{"posts": []}',
+                                                              {'Content-Type': 'application/json; charset=utf-8'})
+
+        r = asyncio.run(self.j.get_posts_recent(channel=test_channel))
+        assert r == (200, {"posts": []})
+
+        args, kwargs = self.session.request.call_args
+        assert args[0] == "GET"
+        assert kwargs["params"]["channel"] == test_channel
+        assert "hashtag" not in kwargs["params"]
+        assert kwargs["headers"]["Authorization"] == "Bearer token"
+
+    def test_bad_gateway_retry(self):
+        self.session.request.return_value = FakeAsyncResponse(502, b'Bad Gateway')
+
+        r = asyncio.run(self.j.upvote("pid"))
+        assert r == (502, "Bad Gateway")
+        assert self.session.request.call_count == 3
+
+    def test_coalesce_requests(self):
+        self.j.coalesce_requests = True
+        self.session.request.return_value = FakeAsyncResponse(200, b'{"posts": []}',
+                                                              {'Content-Type': 'application/json; charset=utf-8'})
+
+        async def read_feeds():
+            return await asyncio.gather(*[self.j.get_posts_recent() for _ in range(3)])
+
+        results = asyncio.run(read_feeds())
+        assert results == [(200, {"posts": []})] * 3
+        assert results[0][1] is not results[1][1]
+        assert self.session.request.call_count == 1
+        assert self.j._in_flight == {}
+
+    def test_iter_posts(self):
+        pages = {None: ["p1", "p2"], "p2": ["p3", "p4"], "p4": ["p5"], "p5": []}
+
+        async def get_posts(method, endpoint, params=None, **kwargs):
+            return 200, {"posts": [{"post_id": pid} for pid in pages[params["after"]]]}
+
+        async def collect():
+            return [post["post_id"] async for post in self.j.iter_posts_popular()]
+
+        with patch.object(self.j, '_send_request', side_effect=get_posts):
+            assert asyncio.run(collect()) == ["p1", "p2", "p3", "p4", "p5"]
+
+    def test_iter_mine_ignored_skip(self):
+        async def get_posts(method, endpoint, params=None, **kwargs):
+            return 200, {"posts": [{"post_id": "p1"}, {"post_id": "p2"}]}
+
+        async def collect():
+            return [post["post_id"] async for post in self.j.iter_my_voted_posts()]
+
+        with patch.object(self.j, '_send_request', side_effect=get_posts):
+            assert asyncio.run(collect()) == ["p1", "p2"]
+
+    def test_pickle(self):
+        j = jodel_api.AsyncJodelAccount(lat, lng, city, **offline_account)
+        j._in_flight["key"] = None
+        j2 = pickle.loads(pickle.dumps(j))
+        assert j2.access_token == "token" and j2._in_flight == {}
+
+    def test_load_and_pool(self, tmpdir):
+        store = jodel_api.AccountStore(str(tmpdir.join("accounts.db")))
+        store.save(offline_account)
+        store.save(dict(offline_account, device_uid="b" * 64, access_token=None))
+
+        accounts = store.load(lat, lng, city, account_class=jodel_api.AsyncJodelAccount)
+        assert [j.access_token for j in accounts] == ["token", None]
+
+        pool = jodel_api.AccountPool.from_account_data(store.all(), lat, lng, city,
+                                                       account_class=jodel_api.AsyncJodelAccount)
+        assert all(isinstance(j, jodel_api.AsyncJodelAccount) for j in pool.accounts)
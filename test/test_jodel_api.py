@@ -11,8 +11,21 @@ from mock import MagicMock, patch
 import builtins
 import requests
 import os
+import io
+import sys
+import errno
 from flaky import flaky
 import time
+import threading
+import socket
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import copy
+import pickle
+import hmac
+from hashlib import sha1
 
 lat, lng, city = 49.021785, 12.103129, "Regensburg"
 test_channel = "WasGehtHeute?"
@@ -384,3 +397,1074 @@ class TestLegacyVerifiedAccount:
     def test_vote(self):
         assert self.j.upvote(self.pid1)[0] == 200
         assert self.j.downvote(self.pid2)[0] == 200
+
+
+def make_response(status_code, data=None, headers=None):
+    resp = requests.Response()
+    resp.status_code, resp.headers = status_code, requests.structures.CaseInsensitiveDict(headers or {})
+    if isinstance(data, dict):
+        resp._content = json.dumps(data).encode("utf-8")
+        resp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    else:
+        resp._content = (data or "").encode("utf-8")
+    return resp
+
+
+offline_account = {'access_token': 'token', 'device_uid': 'a' * 64, 'refresh_token': 'refresh',
+                   'distinct_id': 'distinct', 'expiration_date': 4102444800, 'is_legacy': False}
+
+
+class TestSession:
+
+    def test_account_session(self):
+        session = jodel_api.create_session(pool_maxsize=50)
+        assert session.get_adapter("https://api.go-tellm.com")._pool_maxsize == 50
+
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, session=session, timeout=7, **offline_account)
+        with patch.object(session, 'request') as request_func:
+            request_func.return_value = make_response(204)
+            assert j.upvote("pid")[0] == 204
+            assert request_func.call_args[1]["timeout"] == 7
+
+            j.upvote("pid", timeout=3)
+            assert request_func.call_args[1]["timeout"] == 3
+
+
+class TestBatch:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+    def test_batch_order_and_errors(self):
+        with patch.object(self.j, '_send_request', side_effect=lambda method, endpoint, **kwargs: (200, endpoint)):
+            r = self.j.batch([("upvote", "pid1"), ("get_post_details_v3", "pid2", {"skip": 50}),
+                              ("notification_read",)], max_workers=3)
+
+        assert r[0] == (200, "/v2/posts/pid1/upvote/")
+        assert r[1] == (200, "/v3/posts/pid2/details")
+        assert isinstance(r[2], ValueError)
+
+    def test_batch_unknown_method(self):
+        with pytest.raises(ValueError):
+            self.j.batch([("_send_request", "GET", "/")])
+
+
+class ShortReads(io.RawIOBase):
+    """ Unbuffered file that returns at most 1000 bytes per read(). """
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, *args):
+        return self.data.seek(*args)
+
+    def tell(self):
+        return self.data.tell()
+
+    def readinto(self, b):
+        chunk = self.data.read(min(len(b), 1000))
+        b[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class TestSigning:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+    def test_signature(self):
+        payload = {"message": "äöü", "location": self.j.location_dict}
+        params = {"b": 1, "a": None}
+        body = self.j._encode_payload(payload)
+        assert json.loads(body.decode("utf-8")) == payload
+
+        headers = {}
+        with patch('jodel_api.jodel_api.time.strftime', return_value="2017-01-01T00:00:00Z"):
+            self.j._sign_request("POST", "/v3/posts/", headers, params, body)
+
+        req = "%".join(["POST", "api.go-tellm.com", "443", "/api/v3/posts/", "token", "2017-01-01T00:00:00Z",
+                        "a%None%b%1", json.dumps(payload)])
+        expected = hmac.new(self.j.secret, req.encode("utf-8"), sha1).hexdigest().upper()
+        assert headers['X-Authorization'] == 'HMAC ' + expected
+        assert headers['X-Timestamp'] == "2017-01-01T00:00:00Z"
+
+    @patch('jodel_api.s.request')
+    def test_sends_signed_body(self, requests_func):
+        requests_func.return_value = make_response(204)
+
+        self.j.set_location(lat, lng, city)
+        body = requests_func.call_args[1]["data"]
+        assert json.loads(body.decode("utf-8")) == {"location": self.j.location_dict}
+        assert "json" not in requests_func.call_args[1]
+
+    @patch('jodel_api.s.request')
+    def test_streamed_image(self, requests_func, tmpdir):
+        requests_func.return_value = make_response(200, {"post_id": "pid"})
+        image = os.urandom(3 * 2 ** 15 + 1)
+        path = tmpdir.join("image.jpg")
+        path.write_binary(image)
+        f = path.open("rb")
+        f.read(1)
+
+        for source, data in (("{}".format(path), image), (image, image), (memoryview(image), image), (f, image[1:]),
+                             (ShortReads(image), image)):
+            with patch('jodel_api.jodel_api.time.strftime', return_value="2017-01-01T00:00:00Z"):
+                assert self.j.create_post(image=source, color="FF9908")[0] == 200
+
+            body, headers = requests_func.call_args[1]["data"], requests_func.call_args[1]["headers"]
+            length = len(body)
+            sent = b"".join(iter(lambda: body.read(1000), b""))
+            assert length == len(sent)
+            payload = json.loads(sent.decode("utf-8"))
+            assert base64.b64decode(payload["image"]) == data
+            assert payload["color"] == "FF9908"
+
+            expected_headers = {}
+            with patch('jodel_api.jodel_api.time.strftime', return_value="2017-01-01T00:00:00Z"):
+                self.j._sign_request("POST", "/v3/posts/", expected_headers, None, sent)
+            assert headers['X-Authorization'] == expected_headers['X-Authorization']
+        f.close()
+
+    def test_image_upload(self):
+        path, received = os.path.join(os.path.dirname(__file__), "testimg.png"), []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(self.rfile.read(int(self.headers["Content-Length"])))
+                self.send_response(502 if len(received) == 1 else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.j.api_url = "http://127.0.0.1:{}/api{{}}".format(server.server_address[1])
+            self.j.session = requests.Session()
+            with patch('jodel_api.jodel_api.time.sleep'):
+                assert self.j.create_post(imgpath=path, color="FF9908") == (200, {})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        with open(path, "rb") as f:
+            image = f.read()
+        assert len(received) == 2 and received[0] == received[1]  # sent again on the retry
+        assert base64.b64decode(json.loads(received[1].decode("utf-8"))["image"]) == image
+
+    @patch('jodel_api.s.request')
+    def test_shrink_image(self, requests_func):
+        Image = pytest.importorskip("PIL.Image")
+        requests_func.return_value = make_response(200, {"post_id": "pid"})
+        out = io.BytesIO()
+        Image.frombytes("RGB", (300, 200), os.urandom(300 * 200 * 3)).save(out, format="PNG")
+        image = out.getvalue()
+
+        assert jodel_api.upload.shrink_image(image, len(image)) is image
+        shrunk = jodel_api.upload.shrink_image(image, 20000)
+        assert len(shrunk) <= 20000
+        img = Image.open(io.BytesIO(shrunk))
+        assert img.format == "JPEG" and img.width < 300 and abs(img.width / float(img.height) - 1.5) < 0.05
+
+        assert self.j.create_post(image=image, max_image_size=20000)[0] == 200
+        payload = json.loads(requests_func.call_args[1]["data"].read().decode("utf-8"))
+        assert len(base64.b64decode(payload["image"])) <= 20000
+
+
+class TestRetryPolicy:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+    def test_backoff(self):
+        policy = jodel_api.RetryPolicy(backoff_factor=1, backoff_max=5, jitter=False)
+        assert [policy.get_backoff(attempt) for attempt in range(1, 6)] == [1, 2, 4, 5, 5]
+        assert policy.get_backoff(1, retry_after="3") == 3
+
+        policy = jodel_api.RetryPolicy(backoff_factor=1)
+        assert 0 <= policy.get_backoff(3) <= 4
+
+    def test_budget(self):
+        policy = jodel_api.RetryPolicy(statuses=(503,), budget=jodel_api.RetryBudget(ratio=0.5, reserve=1))
+        assert policy.is_retry("GET", 1, status=503)
+        assert not policy.is_retry("GET", 1, status=503)
+        policy.record_call()
+        policy.record_call()
+        assert policy.is_retry("GET", 1, status=503)
+        assert not policy.is_retry("GET", 1, status=500)
+
+    @patch('jodel_api.jodel_api.time.sleep')
+    @patch('jodel_api.s.request')
+    def test_retry_status_and_exceptions(self, requests_func, sleep_func):
+        policy = jodel_api.RetryPolicy(max_attempts=4, statuses=(429, 503), exceptions=(requests.ConnectionError,),
+                                       backoff_factor=1, jitter=False)
+        requests_func.side_effect = [requests.ConnectionError(),
+                                     make_response(429, headers={'Retry-After': '7'}),
+                                     make_response(503),
+                                     make_response(204)]
+
+        assert self.j.upvote("pid", retry_policy=policy)[0] == 204
+        assert requests_func.call_count == 4
+        assert [args[0][0] for args in sleep_func.call_args_list] == [1, 7, 4]
+
+    @patch('jodel_api.s.request')
+    def test_no_retry_for_method(self, requests_func):
+        requests_func.side_effect = requests.ConnectionError()
+        self.j.retry_policy = jodel_api.RetryPolicy(exceptions=(requests.ConnectionError,), methods=("GET",))
+
+        with pytest.raises(requests.ConnectionError):
+            self.j.upvote("pid")
+        assert requests_func.call_count == 1
+
+
+class TestRateLimiter:
+
+    def test_token_bucket(self):
+        bucket = jodel_api.TokenBucket(rate=10, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert 0.09 < bucket.reserve() <= 0.1
+        assert 0.19 < bucket.reserve() <= 0.2
+
+    @patch('jodel_api.jodel_api.time.sleep')
+    @patch('jodel_api.s.request')
+    def test_account_rate_limit(self, requests_func, sleep_func):
+        requests_func.return_value = make_response(204)
+        limiter = jodel_api.RateLimiter(read=jodel_api.TokenBucket(1000), write=jodel_api.TokenBucket(1, 1))
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, rate_limiter=limiter, **offline_account)
+
+        j.get_karma()
+        j.upvote("pid")
+        assert not sleep_func.called
+
+        j.downvote("pid")
+        assert sleep_func.call_count == 1
+        assert 0.9 < sleep_func.call_args[0][0] <= 1
+
+    def test_read_endpoints(self):
+        limiter = jodel_api.RateLimiter(read=jodel_api.TokenBucket(1, 1), write=jodel_api.TokenBucket(1, 1))
+        with patch.object(limiter.write, 'reserve', return_value=0.0) as write_func:
+            limiter.reserve("POST", "/v3/posts/search")
+            limiter.reserve("PUT", "/v3/user/notifications")
+            limiter.reserve("GET", "/v3/user/karma")
+            assert not write_func.called
+        assert limiter.read.tokens < -1
+
+        with patch.object(limiter.read, 'reserve', return_value=0.0) as read_func:
+            limiter.reserve("PUT", "/v2/posts/pid/upvote/")
+            limiter.reserve("POST", "/v3/posts/")
+            assert not read_func.called
+
+    @patch('jodel_api.jodel_api.time.sleep')
+    @patch('jodel_api.s.request')
+    def test_global_rate_limit(self, requests_func, sleep_func):
+        requests_func.return_value = make_response(204)
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+        jodel_api.set_global_rate_limiter(jodel_api.RateLimiter(total=jodel_api.TokenBucket(1, 1)))
+        try:
+            j.get_karma()
+            j.get_karma()
+        finally:
+            jodel_api.set_global_rate_limiter(None)
+        assert sleep_func.call_count == 1
+
+
+class TestTokenRefresh:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+    @patch('jodel_api.s.request')
+    def test_refresh_before_expiration(self, requests_func):
+        self.j.expiration_date = time.time() + 60
+        refresh = make_response(200, {"access_token": "new_token", "expiration_date": time.time() + 3600})
+        requests_func.side_effect = [refresh, make_response(204)]
+
+        assert self.j.upvote("pid")[0] == 204
+        assert requests_func.call_args_list[0][1]["url"].endswith("/v2/users/refreshToken")
+        assert requests_func.call_args_list[1][1]["headers"]["Authorization"] == "Bearer new_token"
+
+    @patch('jodel_api.s.request')
+    def test_refresh_single_flight(self, requests_func):
+        self.j.expiration_date = time.time() - 1
+
+        def request(method, url, **kwargs):
+            if url.endswith("refreshToken"):
+                time.sleep(0.2)
+                return make_response(200, {"access_token": "new_token", "expiration_date": time.time() + 3600})
+            return make_response(204)
+        requests_func.side_effect = request
+
+        r = self.j.batch([("upvote", "pid")] * 10, max_workers=10)
+        assert r == [(204, "")] * 10
+        refreshs = [c for c in requests_func.call_args_list if c[1]["url"].endswith("refreshToken")]
+        assert len(refreshs) == 1
+
+    @patch('jodel_api.s.request')
+    def test_refresh_on_401(self, requests_func):
+        refresh = make_response(200, {"access_token": "new_token", "expiration_date": time.time() + 3600})
+        requests_func.side_effect = [make_response(401, "Unauthorized"), refresh, make_response(204),
+                                     make_response(401, "Unauthorized")]
+
+        assert self.j.upvote("pid")[0] == 204
+        # don't refresh again right after a refresh
+        assert self.j.upvote("pid")[0] == 401
+        assert requests_func.call_count == 4
+
+    @patch('jodel_api.s.request')
+    def test_pickle(self, requests_func):
+        requests_func.return_value = make_response(204)
+        lazy = jodel_api.JodelAccount(lat, lng, city, lazy=True, **offline_account)
+        for j in (self.j, lazy, copy.deepcopy(self.j)):
+            j2 = pickle.loads(pickle.dumps(j))
+            assert j2.get_account_data() == j.get_account_data()
+            assert j2.upvote("pid")[0] == 204
+
+    @patch('jodel_api.jodel_api.time.sleep')
+    @patch('jodel_api.s.request')
+    def test_token_changed_between_retries(self, requests_func, sleep_func):
+        def request(method, url, headers, **kwargs):
+            sent.append(dict(headers))
+            self.j.access_token = "new_token"  # refreshed by another thread during the backoff
+            return make_response(502 if len(sent) == 1 else 204)
+        sent = []
+        requests_func.side_effect = request
+
+        with patch('jodel_api.jodel_api.time.strftime', return_value="2017-01-01T00:00:00Z"):
+            assert self.j.upvote("pid")[0] == 204
+            for access_token, headers in zip(["token", "new_token"], sent):
+                expected = {}
+                self.j._sign_request("PUT", "/v2/posts/pid/upvote/", expected, None, b"", access_token)
+                assert headers["Authorization"] == "Bearer " + access_token
+                assert headers["X-Authorization"] == expected["X-Authorization"]
+
+
+class TestCodec:
+
+    def test_decode(self):
+        codec = jodel_api.JsonCodec()
+        assert codec.decode(b'{"a": 1}', 'application/json; charset=utf-8') == {"a": 1}
+        assert codec.decode(b'{"a": 1}', 'text/html') == {"a": 1}
+        assert codec.decode(b'{"a": ', 'text/html') == '{"a": '
+        assert codec.decode(b'1', 'text/html') == '1'
+        assert codec.decode(b'Bad Gateway', 'application/json') == 'Bad Gateway'
+        assert codec.decode(b'', None) == ''
+
+    @patch('jodel_api.s.request')
+    def test_custom_codec(self, requests_func):
+        requests_func.return_value = make_response(200, {"karma": 5})
+        codec = jodel_api.JsonCodec(dumps=lambda obj: json.dumps(obj, separators=(',', ':'), sort_keys=True),
+                                    loads=MagicMock(return_value={"karma": 6}))
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, codec=codec, **offline_account)
+
+        assert j.get_karma() == (200, {"karma": 6})
+        codec._loads.assert_called_once_with(b'{"karma": 5}')
+
+        j.set_user_profile(age=20)
+        assert requests_func.call_args[1]["data"] == b'{"age":20,"gender":null,"user_type":null}'
+
+
+class TestModels:
+
+    post = {"post_id": "p1", "message": "hello", "created_at": "2017-06-17T12:00:00.000Z", "vote_count": 3,
+            "child_count": 1, "color": "FF9908", "distance": 2, "image_url": "//img", "thumbnail_url": "//thumb",
+            "location": {"name": "Munich", "loc_coordinates": {"lat": 48.1, "lng": 11.5}},
+            "children": [{"post_id": "r1", "message": "reply", "vote_count": 0}]}
+
+    def test_post(self):
+        p = jodel_api.Post(self.post)
+        assert (p.post_id, p.vote_count, p.channel, p.location.name) == ("p1", 3, None, "Munich")
+        assert p.get("distance") == 2 and p.get("missing", 5) == 5
+        assert p.image.url == "//img"
+        assert isinstance(p._replies[0], dict)
+        assert [r.post_id for r in p.replies] == ["r1"] and isinstance(p.replies[0], jodel_api.Reply)
+        assert p.to_dict() == self.post
+        assert not hasattr(p, "__dict__")
+
+    @patch('jodel_api.s.request')
+    def test_typed_results(self, requests_func):
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+
+        requests_func.return_value = make_response(200, {"posts": [self.post], "max": 10})
+        status, page = j.get_posts_recent(typed=True)
+        assert isinstance(page, jodel_api.FeedPage) and page.get("max") == 10
+        assert [p.post_id for p in page] == ["p1"]
+        assert "typed" not in requests_func.call_args[1]
+        assert isinstance(j.get_posts_recent()[1], dict)
+
+        details = dict(self.post)
+        replies = details.pop("children")
+        requests_func.return_value = make_response(200, {"details": details, "replies": replies, "next": 1})
+        status, post = j.get_post_details_v3("p1", typed=True)
+        assert post.post_id == "p1" and post.replies[0].post_id == "r1" and post.get("next") == 1
+
+        requests_func.return_value = make_response(404, "Not Found")
+        assert j.get_post_details_v3("p1", typed=True) == (404, "Not Found")
+
+
+class TestIterPosts:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+        self.pages = {None: ["p1", "p2"], "p2": ["p3", "p4"], "p4": ["p5"], "p5": []}
+
+    def get_posts(self, method, endpoint, params=None, **kwargs):
+        return 200, {"posts": [{"post_id": pid} for pid in self.pages[params["after"]]]}
+
+    @pytest.mark.parametrize("prefetch", [True, False])
+    def test_follow_after(self, prefetch):
+        with patch.object(self.j, '_send_request', side_effect=self.get_posts) as send_func:
+            posts = [post["post_id"] for post in self.j.iter_channel(test_channel, prefetch=prefetch)]
+        assert posts == ["p1", "p2", "p3", "p4", "p5"]
+        assert send_func.call_count == 4
+        assert send_func.call_args[1]["params"]["channel"] == test_channel
+
+    def test_max_pages_and_errors(self):
+        with patch.object(self.j, '_send_request', side_effect=self.get_posts):
+            assert len(list(self.j.iter_posts_recent(max_pages=2))) == 4
+
+        with patch.object(self.j, '_send_request', return_value=(500, "error")):
+            with pytest.raises(Exception):
+                list(self.j.iter_posts_recent())
+
+    def test_mine_uses_skip(self):
+        def get_posts(method, endpoint, params=None, **kwargs):
+            return 200, {"posts": [{"post_id": "p%d" % i} for i in range(params["skip"], min(params["skip"] + 2, 5))]}
+
+        with patch.object(self.j, '_send_request', side_effect=get_posts):
+            assert [post["post_id"] for post in self.j.iter_my_voted_posts(limit=2)] == ["p0", "p1", "p2", "p3", "p4"]
+
+    @pytest.mark.parametrize("prefetch", [True, False])
+    def test_mine_ignored_skip(self, prefetch):
+        page = (200, {"posts": [{"post_id": "p1"}, {"post_id": "p2"}]})
+        with patch.object(self.j, '_send_request', return_value=page) as send_func:
+            posts = [post["post_id"] for post in self.j.iter_my_pinned_posts(prefetch=prefetch)]
+        assert posts == ["p1", "p2"]
+        assert send_func.call_count == 2
+
+
+class TestFeedPoller:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+        self.feed = ["p%d" % i for i in range(5, 0, -1)]
+
+    def get_posts(self, method, endpoint, params=None, **kwargs):
+        start = self.feed.index(params["after"]) + 1 if params["after"] else 0
+        return 200, {"posts": [{"post_id": pid} for pid in self.feed[start:start + params["limit"]]]}
+
+    def test_poll(self):
+        poller = jodel_api.FeedPoller(self.j, channel=test_channel, poll_limit=2)
+        with patch.object(self.j, '_send_request', side_effect=self.get_posts) as send_func:
+            assert [p["post_id"] for p in poller.poll()] == ["p5", "p4", "p3", "p2", "p1"]
+            assert poller.poll() == []
+            assert send_func.call_count == 2
+
+            self.feed = ["p9", "p8", "p7", "p6"] + self.feed
+            send_func.reset_mock()
+            assert [p["post_id"] for p in poller.poll()] == ["p9", "p8", "p7", "p6"]
+            # three pages of two posts, the last one contains p5
+            assert send_func.call_count == 3
+            assert send_func.call_args[1]["params"]["channel"] == test_channel
+
+    def test_skip_existing_and_max_seen(self):
+        poller = jodel_api.FeedPoller(self.j, skip_existing=True, max_seen=3)
+        with patch.object(self.j, '_send_request', side_effect=self.get_posts):
+            assert poller.poll() == []
+            assert list(poller._seen) == ["p3", "p4", "p5"]
+
+
+class TestPostStore:
+
+    def test_upsert_and_query(self):
+        store = jodel_api.PostStore()
+        feed = {"posts": [{"post_id": "p1", "message": "#Party tonight", "created_at": "2017-06-17T12:00:00.000Z"},
+                          {"post_id": "p2", "message": "hello", "created_at": "2017-06-17T13:00:00.000Z"}]}
+        assert store.upsert((200, feed), channel=test_channel) == 2
+        assert store.upsert((404, "Not found")) == 0
+
+        details = {"details": {"post_id": "p1", "message": "#Party tonight", "vote_count": 5,
+                               "created_at": "2017-06-17T12:00:00.000Z"},
+                   "replies": [{"post_id": "r2", "message": "b", "created_at": "2017-06-17T12:02:00.000Z"},
+                               {"post_id": "r1", "message": "a", "created_at": "2017-06-17T12:01:00.000Z"}]}
+        assert store.upsert(details) == 3
+        assert len(store) == 4
+
+        assert [p["post_id"] for p in store.posts_in_channel(test_channel)] == ["p2", "p1"]
+        since = datetime.datetime(2017, 6, 17, 12, 30)
+        assert [p["post_id"] for p in store.posts_in_channel(test_channel, since=since)] == ["p2"]
+        assert [p["post_id"] for p in store.replies_of("p1")] == ["r1", "r2"]
+        assert [p["post_id"] for p in store.posts_with_hashtag("#party")] == ["p1"]
+        assert store.get("p1")["vote_count"] == 5
+
+        # a reply showing up in a feed keeps its parent
+        store.upsert([{"post_id": "r1", "message": "a", "created_at": "2017-06-17T12:01:00.000Z"}])
+        assert [p["post_id"] for p in store.replies_of("p1")] == ["r1", "r2"]
+
+
+class TestLazyAccount:
+
+    @patch('jodel_api.s.request')
+    def test_deferred_location(self, requests_func):
+        j = jodel_api.JodelAccount(lat, lng, city, lazy=True, **offline_account)
+        assert requests_func.call_count == 0
+
+        requests_func.side_effect = [make_response(500), make_response(204), make_response(204)]
+        with pytest.raises(Exception) as excinfo:
+            j.upvote("pid")
+        assert "Error updating location" in str(excinfo.value)
+
+        assert j.upvote("pid")[0] == 204
+        assert [c[1]["url"].split("/api/")[1] for c in requests_func.call_args_list] == \
+            ["v2/users/location", "v2/users/location", "v2/posts/pid/upvote/"]
+
+    @patch('jodel_api.s.request')
+    def test_warm_up_accounts(self, requests_func):
+        tokens = {"access_token": "new_token", "expiration_date": 4102444800, "refresh_token": "refresh",
+                  "distinct_id": "distinct"}
+        requests_func.side_effect = lambda method, url, **kwargs: make_response(200, tokens)
+        accounts = [jodel_api.JodelAccount(lat, lng, city, lazy=True, device_uid="uid{}".format(i)) for i in range(4)]
+        assert requests_func.call_count == 0
+
+        assert jodel_api.warm_up_accounts(accounts, max_workers=4) == [None] * 4
+        assert all(j.access_token == "new_token" for j in accounts)
+        assert requests_func.call_count == 4
+        accounts[0].get_karma()
+        assert requests_func.call_count == 5
+
+class TestAccountStore:
+
+    @patch('jodel_api.s.request')
+    def test_save_and_lazy_refresh(self, requests_func, tmpdir):
+        path = str(tmpdir.join("accounts.db"))
+        store = jodel_api.AccountStore(path)
+        store.save(dict(offline_account, device_uid="uid1", expiration_date=time.time() - 1))
+        store.save(dict(offline_account, device_uid="uid2"))
+
+        accounts = jodel_api.AccountStore(path).load(lat, lng, city)
+        assert [j.device_uid for j in accounts] == ["uid1", "uid2"]
+        assert requests_func.call_count == 0
+
+        refresh = make_response(200, {"access_token": "new_token", "expiration_date": 4102444800})
+        requests_func.side_effect = [refresh, make_response(204)]
+        assert accounts[0].upvote("pid")[0] == 204
+        assert requests_func.call_count == 2
+
+        store = jodel_api.AccountStore(path)
+        assert store.get("uid1")["access_token"] == "new_token"
+        assert store.get("uid2") == dict(offline_account, device_uid="uid2")
+        store.delete("uid2")
+        assert len(store) == 1
+
+    @patch('jodel_api.s.request')
+    def test_load_without_token(self, requests_func, tmpdir):
+        store = jodel_api.AccountStore(str(tmpdir.join("accounts.db")))
+        store.save(dict(offline_account, access_token=None))
+        accounts = store.load(lat, lng, city)
+        assert accounts[0].access_token is None
+        assert requests_func.call_count == 0
+
+class TestResponseCache:
+
+    @patch('jodel_api.s.request')
+    def test_cache_and_invalidate(self, requests_func):
+        cache = jodel_api.ResponseCache(maxsize=2)
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, cache=cache, **offline_account)
+        requests_func.return_value = make_response(200, {"local": []})
+
+        assert j.get_recommended_channels() == (200, {"local": []})
+        j.get_recommended_channels()[1]["local"].append("modified")
+        assert j.get_recommended_channels() == (200, {"local": []})
+        assert requests_func.call_count == 1
+
+        j.get_recommended_channels(use_cache=False)
+        j.get_posts_recent()
+        assert requests_func.call_count == 3
+
+        requests_func.return_value = make_response(204)
+        j.follow_channel(test_channel)
+        requests_func.return_value = make_response(200, {"local": []})
+        j.get_recommended_channels()
+        assert requests_func.call_count == 5
+
+    @patch('jodel_api.s.request')
+    def test_use_cache_false_updates_cache(self, requests_func):
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, cache=jodel_api.ResponseCache(),
+                                   **offline_account)
+        requests_func.return_value = make_response(200, {"local": ["old"]})
+        j.get_recommended_channels()
+
+        requests_func.return_value = make_response(204)
+        j.follow_channel(test_channel, use_cache=False)
+        requests_func.return_value = make_response(200, {"local": ["new"]})
+        assert j.get_recommended_channels() == (200, {"local": ["new"]})
+
+        requests_func.return_value = make_response(200, {"local": ["newer"]})
+        j.get_recommended_channels(use_cache=False)
+        assert j.get_recommended_channels() == (200, {"local": ["newer"]})
+        assert requests_func.call_count == 4
+
+    def test_ttl_and_lru(self):
+        cache = jodel_api.ResponseCache(ttls={"/a": 10, "/b": 10}, maxsize=2)
+        for endpoint in ("/a", "/b"):
+            cache.set("acc", "GET", endpoint, None, 200, {})
+        assert cache.get("acc", "GET", "/a") == (200, {})
+        cache.set("acc", "GET", "/b", {"x": 1}, 200, {})
+        assert cache.get("acc", "GET", "/b") is None
+        assert cache.get("acc", "GET", "/a") == (200, {})
+        assert cache.get("other", "GET", "/a") is None
+
+        with patch('jodel_api.cache.time.time', return_value=time.time() + 11):
+            assert cache.get("acc", "GET", "/a") is None
+
+    def test_coalesce_requests(self):
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, coalesce_requests=True, **offline_account)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_request(method, url, **kwargs):
+            started.set()
+            release.wait(5)
+            return make_response(200, {"posts": []})
+
+        with patch('jodel_api.s.request', side_effect=slow_request) as requests_func:
+            with ThreadPoolExecutor(5) as executor:
+                first = executor.submit(j.get_posts_recent)
+                started.wait(5)
+                others = [executor.submit(j.get_posts_recent) for _ in range(3)]
+                other_channel = executor.submit(j.get_posts_recent, channel=test_channel)
+                time.sleep(0.1)
+                release.set()
+                results = [f.result() for f in [first] + others]
+
+            assert other_channel.result() == (200, {"posts": []})
+            assert requests_func.call_count == 2
+            assert all(r == (200, {"posts": []}) for r in results)
+            results[0][1]["posts"].append("modified")
+            assert results[1] == (200, {"posts": []})
+
+
+class TestCrawlThread:
+
+    def setup_method(self, method):
+        self.j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+        self.replies = [{"post_id": "r%d" % i} for i in range(7)]
+
+    def get_details(self, method, endpoint, params=None, **kwargs):
+        skip = params["reply"]
+        page = self.replies[skip:skip + 3]
+        remaining = max(0, len(self.replies) - skip - 3)
+        return 200, {"details": {"post_id": "p1", "child_count": len(self.replies)}, "replies": page,
+                     "next": skip + 3 if remaining else None, "remaining": remaining}
+
+    def test_crawl(self):
+        with patch.object(self.j, '_send_request', side_effect=self.get_details) as send_func:
+            status, thread = jodel_api.crawl_thread(self.j, "p1", max_workers=4)
+        assert status == 200
+        assert [r["post_id"] for r in thread["replies"]] == ["r%d" % i for i in range(7)]
+        assert thread["remaining"] == 0
+        assert sorted(c[1]["params"]["reply"] for c in send_func.call_args_list) == [0, 3, 6]
+
+    def test_crawl_error(self):
+        def get_details(method, endpoint, params=None, **kwargs):
+            return (500, "error") if params["reply"] == 6 else self.get_details(method, endpoint, params)
+
+        with patch.object(self.j, '_send_request', side_effect=get_details):
+            assert jodel_api.crawl_thread(self.j, "p1") == (500, "error")
+
+
+class TestSweepLocations:
+
+    def test_sweep(self):
+        accounts = [jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account) for _ in range(3)]
+        active = set()
+
+        def send_request(account, method, endpoint, params=None, payload=None, **kwargs):
+            assert account not in active  # an account is only used for one location at a time
+            active.add(account)
+            time.sleep(0.01)
+            active.remove(account)
+            if endpoint == "/v2/users/location":
+                return 204, ""
+            return 200, {"posts": [], "lat": params["lat"], "limit": params["limit"]}
+
+        locations = [(lat + i, lng, "city%d" % i) for i in range(10)] + [{"lat": 1, "lng": 2, "city": "x"}]
+        with patch.object(jodel_api.JodelAccount, '_send_request', autospec=True, side_effect=send_request):
+            results = list(jodel_api.sweep_locations(accounts, locations, fetch="get_posts_popular", limit=5))
+
+        assert len(results) == 11
+        for location, (status, resp) in results:
+            assert status == 200 and resp["limit"] == 5
+            assert resp["lat"] == (location["lat"] if isinstance(location, dict) else location[0])
+
+    def test_no_accounts(self):
+        with pytest.raises(ValueError):
+            jodel_api.sweep_locations([], [(lat, lng, city)])
+
+
+class TestActionQueue:
+
+    @patch('jodel_api.s.request')
+    def test_run(self, requests_func):
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+        policy = jodel_api.RetryPolicy(max_attempts=2, statuses=(503,), jitter=False)
+        queue = jodel_api.ActionQueue(j, max_workers=4, rate=1000, retry_policy=policy)
+        queue.extend("upvote", ["p1", "p2"])
+        queue.put("notification_read", "p3")
+        queue.put("downvote", "p4")
+        with pytest.raises(ValueError):
+            queue.put("delete_post", "p5")
+        assert len(queue) == 4
+
+        def request(method, url, **kwargs):
+            return make_response(503 if "p4" in url else 204)
+
+        requests_func.side_effect = request
+        results = queue.run()
+        assert [(action, post_id, result[0]) for action, post_id, result in results] == \
+            [("upvote", "p1", 204), ("upvote", "p2", 204), ("notification_read", "p3", 204), ("downvote", "p4", 503)]
+        assert requests_func.call_count == 5
+        assert queue.report["succeeded"] == 3 and queue.report["failed"] == 1
+        assert len(queue) == 0
+
+
+class TestMediaFetcher:
+
+    def setup_method(self, method):
+        self.session = MagicMock()
+        self.contents = {}
+
+        def get(url, **kwargs):
+            resp = MagicMock()
+            resp.status_code = 200 if url in self.contents else 404
+            resp.iter_content.return_value = [self.contents.get(url, b"")[:5], self.contents.get(url, b"")[5:]]
+            return resp
+
+        self.session.get.side_effect = get
+
+    def test_cache(self, tmpdir):
+        self.contents = {"https://img/a.jpg": b"image a data", "https://img/a2.jpg": b"image a data",
+                         "https://img/b.jpg": b"image b data"}
+        fetcher = jodel_api.MediaFetcher(str(tmpdir), session=self.session)
+        paths = fetcher.fetch_all(["//img/a.jpg", "https://img/a2.jpg", "https://img/b.jpg", "https://img/c.jpg"])
+        assert paths[0] == paths[1] != paths[2]
+        assert open(paths[2], "rb").read() == b"image b data"
+        assert "404" in str(paths[3])
+        assert fetcher.size == 24
+
+        fetcher = jodel_api.MediaFetcher(str(tmpdir), max_size=30, session=self.session)
+        assert fetcher.fetch("https://img/a.jpg") == paths[0]
+        assert self.session.get.call_count == 4
+
+        self.contents["https://img/d.jpg"] = b"image d data"
+        fetcher.fetch("https://img/d.jpg")
+        assert not os.path.exists(paths[2]) and os.path.exists(paths[0])
+        assert fetcher.size == 24
+
+    def test_dedupe(self, tmpdir):
+        self.contents = {"https://img/a.jpg": b"image a data"}
+        started, release = threading.Event(), threading.Event()
+        get = self.session.get.side_effect
+
+        def slow_get(url, **kwargs):
+            started.set()
+            release.wait(5)
+            return get(url, **kwargs)
+
+        self.session.get.side_effect = slow_get
+        fetcher = jodel_api.MediaFetcher(str(tmpdir), session=self.session)
+        with ThreadPoolExecutor(4) as executor:
+            first = executor.submit(fetcher.fetch, "https://img/a.jpg")
+            started.wait(5)
+            others = [executor.submit(fetcher.fetch, "https://img/a.jpg") for _ in range(3)]
+            time.sleep(0.1)
+            release.set()
+            assert len(set(f.result() for f in [first] + others)) == 1
+        assert self.session.get.call_count == 1
+
+    def test_get_image_urls(self):
+        resp = {"posts": [{"post_id": "1", "image_url": "//img/1.jpg", "thumbnail_url": "//img/1t.jpg"},
+                          {"post_id": "2", "message": "text"}]}
+        assert jodel_api.get_image_urls((200, resp)) == ["//img/1.jpg"]
+        assert jodel_api.get_image_urls(jodel_api.FeedPage(resp), thumbnails=True) == ["//img/1t.jpg"]
+
+
+class TestAccountPool:
+
+    def setup_method(self, method):
+        self.data = [dict(offline_account, device_uid="uid{}".format(i)) for i in range(3)]
+
+    def test_round_robin_and_quarantine(self):
+        pool = jodel_api.AccountPool.from_account_data(self.data, lat, lng, city, max_errors=2, quarantine=60)
+        assert [pool.acquire().device_uid for _ in range(4)] == ["uid0", "uid1", "uid2", "uid0"]
+        for account in pool:
+            pool.release(account)
+        pool.release(pool.accounts[0])
+
+        with patch('jodel_api.s.request') as requests_func:
+            requests_func.side_effect = lambda method, url, **kwargs: make_response(
+                401 if kwargs["headers"]["Authorization"] == "Bearer bad" else 204)
+            pool.accounts[1].access_token, pool.accounts[1].refresh_token = "bad", None
+            results = [pool.call("upvote", "pid") for _ in range(6)]
+
+        assert [r[0] for r in results] == [401, 204, 204, 401, 204, 204]
+        assert [s["quarantined"] for s in pool.stats()] == [False, True, False]
+        assert pool.stats()[1]["errors"] == 2 and pool.stats()[0]["error_rate"] == 0.0
+        assert [pool.acquire().device_uid for _ in range(3)] == ["uid2", "uid0", "uid2"]
+
+        with patch('jodel_api.pool.time.time', return_value=time.time() + 61):
+            assert "uid1" in [pool.acquire().device_uid for _ in range(3)]
+            pool.release(pool.accounts[1], Exception())
+            assert pool.stats()[1]["quarantined"]
+
+    def test_least_loaded(self):
+        pool = jodel_api.AccountPool.from_account_data(self.data, lat, lng, city, strategy="least_loaded")
+        first, second = pool.acquire(), pool.acquire()
+        assert first is not second
+        pool.release(first)
+        assert pool.acquire() is pool.accounts[2]
+        assert pool.acquire() is first
+
+
+class TestCreateVerifiedAccounts:
+
+    @patch('jodel_api.s.request')
+    @patch('jodel_api.jodel_api.gcmhack.AndroidAccount')
+    def test_pipeline(self, android_account_class, requests_func):
+        uids, lock, active, max_active = iter(range(100)), threading.Lock(), [0], [0]
+
+        def checkin():
+            with lock:
+                active[0] += 1
+                max_active[0] = max(max_active[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            android_account = MagicMock()
+            android_account.get_push_token.return_value = "push_token"
+            android_account.receive_verification_from_gcm.return_value = {"server_time": 1, "verification_code": "c"}
+            return android_account
+
+        def request(method, url, **kwargs):
+            if url.endswith("/v2/users"):
+                return make_response(200, {"access_token": "token{}".format(next(uids)), "expiration_date": 4102444800,
+                                           "refresh_token": "refresh", "distinct_id": "distinct"})
+            if url.endswith("/v2/users/pushToken"):
+                return make_response(204)
+            status = 400 if kwargs["headers"]["Authorization"] == "Bearer token0" else 200
+            return make_response(status, {"verified": status == 200})
+
+        android_account_class.side_effect = checkin
+        requests_func.side_effect = request
+        results = list(jodel_api.create_verified_accounts(6, lat, lng, city, limits={"checkin": 2},
+                                                          attempts=2))
+
+        assert len(results) == 6 and max_active[0] == 2
+        assert sorted(result[0] for account, result in results) == [200] * 5 + [400]
+        assert all(isinstance(account, jodel_api.JodelAccount) for account, result in results)
+        verify_calls = [c for c in requests_func.call_args_list if c[1]["url"].endswith("/verification/push")]
+        assert len(verify_calls) == 7
+
+    @patch('jodel_api.s.request')
+    def test_shared_mcs_connection(self, requests_func):
+        requests_func.side_effect = [make_response(204), make_response(200, {"verified": True})]
+        android_account, mcs_client = MagicMock(), MagicMock()
+        android_account.get_push_token.return_value = "push_token"
+        mcs_client.add.return_value = False  # the connection was added by someone else
+        mcs_client.wait_for_verification.return_value = {"server_time": 1, "verification_code": "c"}
+
+        j = jodel_api.JodelAccount(lat, lng, city, update_location=False, **offline_account)
+        assert j.verify(android_account, mcs_client=mcs_client)[0] == 200
+        assert not mcs_client.remove.called
+
+
+class FakeMcsSocket:
+    """ A plain socket (one end of a socketpair) with the pending() method of an ssl socket. """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def pending(self):
+        return 0
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class TestGcmVerification:
+
+    def setup_method(self, method):
+        from jodel_api.protos import mcs_pb2
+        self.a = jodel_api.AndroidAccount(android_id=1, security_token=2)
+        self.server, client = socket.socketpair()
+        client.setblocking(False)
+        self.a.sock, self.a.parser, self.a.counter = FakeMcsSocket(client), jodel_api.gcmhack.McsParser(), 0
+        self.server.sendall(b"\x29")  # version
+
+        self.stanzas = []
+        for code in ("1", "2"):
+            dms = mcs_pb2.DataMessageStanza()
+            setattr(dms, "from", "425112442765")
+            dms.category = "com.tellm.android.app"
+            for key, value in (("message_type_id", "16"),
+                               ("payload", json.dumps({"server_time": 1, "verification_code": code}))):
+                app_data = dms.app_data.add()
+                app_data.key, app_data.value = key, value
+            data = dms.SerializeToString()
+            self.stanzas.append(b"\x08" + bytes(bytearray([len(data)])) + data)
+
+    def teardown_method(self, method):
+        self.server.close()
+        self.a.sock.close()
+
+    def test_returns_when_push_arrives(self):
+        timer = threading.Timer(0.1, lambda: self.server.sendall(b"\x03\x00" + b"".join(self.stanzas)))
+        timer.start()
+        start = time.time()
+        assert self.a.receive_verification_from_gcm(timeout=5)["verification_code"] == "2"
+        assert time.time() - start < 1
+
+    def test_split_message_and_deadline(self):
+        self.server.sendall(self.stanzas[0][:10])
+        threading.Timer(0.1, lambda: self.server.sendall(self.stanzas[0][10:])).start()
+        assert self.a.receive_verification_from_gcm(timeout=5)["verification_code"] == "1"
+
+        start = time.time()
+        with pytest.raises(jodel_api.gcmhack.GcmException):
+            self.a.receive_verification_from_gcm(timeout=0.3)
+        assert 0.3 <= time.time() - start < 1
+
+
+@pytest.mark.skipif(sys.version_info < (3, 6), reason="McsClient requires Python 3.4, the test server 3.6")
+class TestMcsClient:
+
+    @pytest.fixture
+    def server(self, tmpdir):
+        """ A TLS server that answers the login of every connection and then pushes a verification. """
+        from jodel_api.protos import mcs_pb2
+        cert, key = str(tmpdir.join("cert.pem")), str(tmpdir.join("key.pem"))
+        if os.system("openssl req -x509 -newkey rsa:2048 -nodes -subj /CN=localhost -keyout {} -out {} "
+                     "-days 1 >/dev/null 2>&1".format(key, cert)) != 0:
+            pytest.skip("openssl is not available")
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(16)
+        received = []
+
+        def handle(conn):
+            with context.wrap_socket(conn, server_side=True) as sock:
+                parser = jodel_api.gcmhack.McsParser()
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        return
+                    for tag, msg in parser.feed(data):
+                        received.append(tag)
+                        if tag != 2:
+                            continue
+                        login = mcs_pb2.LoginRequest()
+                        login.ParseFromString(msg)
+                        dms = mcs_pb2.DataMessageStanza()
+                        setattr(dms, "from", "425112442765")
+                        dms.category = "com.tellm.android.app"
+                        for key, value in (("message_type_id", "16"), ("payload", json.dumps(
+                                {"server_time": 1, "verification_code": login.user}))):
+                            app_data = dms.app_data.add()
+                            app_data.key, app_data.value = key, value
+                        sock.sendall(b"\x29" + jodel_api.gcmhack.encode_message(3, mcs_pb2.LoginResponse(id="x")) +
+                                     jodel_api.gcmhack.encode_message(8, dms))
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=serve, daemon=True).start()
+        yield listener.getsockname()[1], cert, received
+        listener.close()
+
+    def test_verifications(self, server):
+        port, cert, received = server
+        context = ssl.create_default_context(cafile=cert)
+        context.check_hostname = False
+        accounts = [jodel_api.AndroidAccount(android_id=i, security_token=i) for i in range(1, 21)]
+        messages = []
+
+        with jodel_api.McsClient(heartbeat_interval=0.2, ssl_context=context) as client:
+            client.host, client.port = "127.0.0.1", port
+            for a in accounts:
+                client.add(a, callback=lambda a, dms: messages.append(a))
+            assert not client.add(accounts[0])
+
+            codes = [client.wait_for_verification(a, timeout=10)["verification_code"] for a in accounts]
+            assert codes == [str(i) for i in range(1, 21)]
+            assert len(messages) == 20
+            assert threading.active_count() < 30 + 20  # one loop thread, the server uses one per connection
+
+            time.sleep(0.5)
+            assert 0 in received  # heartbeats
+            client.remove(accounts[0])
+            assert len(client) == 19
+
+    @patch('jodel_api.mcs.socket.getaddrinfo')
+    def test_resolves_host_once(self, getaddrinfo_func):
+        getaddrinfo_func.return_value = [(socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", 5228, 0, 0))]
+        client = jodel_api.McsClient()
+        try:
+            with patch('jodel_api.mcs.socket.socket') as socket_class, patch.object(client.selector, 'register'):
+                socket_class.return_value.connect_ex.return_value = errno.EINPROGRESS
+                for i in range(1, 4):
+                    client.add(jodel_api.AndroidAccount(android_id=i, security_token=i))
+                client.run_once(timeout=0)
+        finally:
+            client.close()
+
+        assert getaddrinfo_func.call_count == 1
+        assert socket_class.call_count == 3
+        socket_class.assert_called_with(socket.AF_INET6, socket.SOCK_STREAM)
+        socket_class.return_value.connect_ex.assert_called_with(("::1", 5228, 0, 0))
+
+    @patch('jodel_api.mcs.socket.getaddrinfo')
+    def test_resolves_again_after_failures(self, getaddrinfo_func):
+        old = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (ip, 5228)) for ip in ("10.0.0.1", "10.0.0.2")]
+        new = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.3", 5228))]
+        getaddrinfo_func.side_effect = [old, new]
+        client = jodel_api.McsClient()
+        try:
+            client.add(jodel_api.AndroidAccount(android_id=1, security_token=1))
+            conn = list(client._connections.values())[0]
+            with patch('jodel_api.mcs.socket.socket') as socket_class:
+                socket_class.return_value.connect_ex.return_value = errno.ECONNREFUSED
+                for i in range(2):
+                    conn.reconnect_at = 0
+                    client.run_once(timeout=0)
+                client._resolver.join()
+
+                socket_class.return_value.connect_ex.return_value = errno.EINPROGRESS
+                conn.reconnect_at = 0
+                with patch.object(client.selector, 'register'):
+                    client.run_once(timeout=0)
+        finally:
+            client.close()
+
+        assert getaddrinfo_func.call_count == 2
+        assert [args[0][0] for args in socket_class.return_value.connect_ex.call_args_list] == \
+            [("10.0.0.1", 5228), ("10.0.0.2", 5228), ("10.0.0.3", 5228)]